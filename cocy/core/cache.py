@@ -0,0 +1,102 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from time import time
+from collections import OrderedDict
+
+
+class ExpiringSet(object):
+    """
+    A set whose members are removed *ttl* seconds after they have
+    been added. The set holds at most *max_size* members, the oldest
+    member is removed when this limit is reached.
+
+    If *index* is given, it must be a function that derives a
+    secondary key from a member. The members with a given secondary
+    key can then be looked up with :meth:`indexed` without scanning
+    the set.
+
+    The number of successful (member was already known) and failed
+    lookups by :meth:`add` is available as :attr:`hits` and
+    :attr:`misses`.
+    """
+
+    def __init__(self, ttl, max_size=4096, index=None):
+        self.ttl = ttl
+        self._max_size = max_size
+        # Keys in order of insertion, i.e. expiry
+        self._members = OrderedDict()
+        self._index_key = index
+        # Maps secondary keys to the set of members with that key
+        self._index = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._members)
+
+    def __iter__(self):
+        return iter(self._members.keys())
+
+    def add(self, key, now=None):
+        """
+        Add the key to the set. Returns ``True`` if the key has been
+        added and ``False`` if the key was already in the set. Adding
+        a key that is already in the set does not extend its lifetime.
+        """
+        now = time() if now is None else now
+        members = self._members
+        while members:
+            oldest, expiry = next(members.iteritems())
+            if expiry > now:
+                break
+            del members[oldest]
+            self._unindex(oldest)
+        if key in members:
+            self.hits += 1
+            return False
+        self.misses += 1
+        if len(members) >= self._max_size:
+            self._unindex(members.popitem(last=False)[0])
+        members[key] = now + self.ttl
+        if self._index_key is not None:
+            self._index.setdefault(self._index_key(key), set()).add(key)
+        return True
+
+    def discard(self, key):
+        if self._members.pop(key, None) is not None:
+            self._unindex(key)
+
+    def indexed(self, index_key):
+        """
+        Return the members with the given secondary key as list.
+        """
+        return list(self._index.get(index_key, ()))
+
+    def _unindex(self, key):
+        if self._index_key is None:
+            return
+        index_key = self._index_key(key)
+        keys = self._index.get(index_key)
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del self._index[index_key]
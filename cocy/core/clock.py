@@ -0,0 +1,38 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from time import time
+from email.utils import formatdate
+
+_http_date = (None, None)
+
+def http_date(now=None):
+    """
+    Return the given time (defaults to the current time) as RFC 1123
+    date string as used in HTTP headers. Because the string has a
+    resolution of one second, it is formatted at most once per second.
+    """
+    global _http_date
+    now = int(time() if now is None else now)
+    stamp, value = _http_date
+    if stamp != now:
+        value = formatdate(now, usegmt=True)
+        _http_date = (now, value)
+    return value
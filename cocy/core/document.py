@@ -0,0 +1,279 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+import time
+import zlib
+import hashlib
+from email.utils import parsedate_tz, mktime_tz
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from circuits.core.utils import flatten
+from circuits.web.headers import Headers
+from cocy.core.clock import http_date
+
+# A "304 Not Modified" has no representation headers
+_NOT_MODIFIED_OMITTED = ("Content-Type", "Content-Length", "Content-Encoding")
+
+
+class StaticDocument(object):
+    """
+    A document that is served unchanged until it is replaced by
+    a new version, e.g. the description of a device for a given
+    configuration id.
+
+    The document has a strong entity tag derived from *version* and
+    the content, and a last modification time (defaults to the time
+    of creation). Conditional GETs (``If-None-Match``,
+    ``If-Modified-Since``) are answered with "304 Not Modified".
+    If the client accepts it and *compress* is ``True``, the body is 
+    sent gzip compressed. The compressed body is computed when it is 
+    first needed and then kept. If *max_age* is given, clients are
+    allowed to cache the document for *max_age* seconds.
+    """
+
+    def __init__(self, body, content_type, version, last_modified=None,
+                 max_age=None, compress=True):
+        if isinstance(body, unicode):
+            body = body.encode("utf-8")
+        self.body = body
+        self.content_type = content_type
+        tag = "%s-%s" % (version, hashlib.md5(body).hexdigest()[:12])
+        self.etag = '"%s"' % tag
+        self._gzip_etag = '"%s-gz"' % tag
+        self.last_modified = int(time.time() if last_modified is None
+                                 else last_modified)
+        self._last_modified_header = http_date(self.last_modified)
+        self._cache_control = None if max_age is None \
+            else "max-age=%d" % max_age
+        self._gzipped = None if compress else False
+        # Encoded headers, see respond()
+        self._encoded = dict()
+
+    @property
+    def gzipped(self):
+        """
+        The gzip compressed body or ``None`` if compression doesn't
+        make the body smaller.
+        """
+        if self._gzipped is None:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            data = compressor.compress(self.body) + compressor.flush()
+            self._gzipped = data if len(data) < len(self.body) else False
+        return self._gzipped or None
+
+    def serve(self, request, response):
+        """
+        Set the headers of the *response* and return the body to send.
+        A "304 Not Modified" is prepared as by :meth:`respond` and the
+        *response* is returned, because circuits would add a
+        ``Content-Length`` (and a default ``Content-Type``) for an
+        empty body.
+        """
+        if self.not_modified(request.headers):
+            return self.respond(request, response)
+        headers = response.headers
+        headers["Date"] = http_date()
+        headers["Content-Type"] = self.content_type
+        headers["Last-Modified"] = self._last_modified_header
+        headers["Vary"] = "Accept-Encoding"
+        if self._cache_control is not None:
+            headers["Cache-Control"] = self._cache_control
+        body = self.body
+        etag = self.etag
+        if _accepts_gzip(request.headers.get("Accept-Encoding")):
+            gzipped = self.gzipped
+            if gzipped is not None:
+                body = gzipped
+                etag = self._gzip_etag
+                headers["Content-Encoding"] = "gzip"
+        headers["ETag"] = etag
+        return body
+
+    def respond(self, request, response):
+        """
+        Like :meth:`serve`, but the headers of the *response* are
+        replaced with pre-encoded headers (see :class:`EncodedHeaders`).
+        Returns the *response*.
+        """
+        gzipped = None
+        if _accepts_gzip(request.headers.get("Accept-Encoding")):
+            gzipped = self.gzipped
+        not_modified = self.not_modified(request.headers)
+        key = (gzipped is not None, not_modified)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            headers = [("Last-Modified", self._last_modified_header),
+                       ("Vary", "Accept-Encoding"),
+                       ("ETag", self._gzip_etag if gzipped is not None
+                        else self.etag)]
+            if self._cache_control is not None:
+                headers.append(("Cache-Control", self._cache_control))
+            # A "304 Not Modified" has no representation headers
+            if not not_modified:
+                headers.insert(0, ("Content-Type", self.content_type))
+                if gzipped is not None:
+                    headers.append(("Content-Encoding", "gzip"))
+                headers.append(("Content-Length",
+                                str(len(gzipped or self.body))))
+            encoded = "".join(["%s: %s\r\n" % header for header in headers])
+            self._encoded[key] = encoded
+        server = response.headers.get("Server")
+        # circuits adds a Content-Length (and a default Content-Type)
+        # for the empty body of a "304 Not Modified"
+        response.headers = EncodedHeaders \
+            (encoded, _NOT_MODIFIED_OMITTED if not_modified else ())
+        if server is not None:
+            response.headers["Server"] = server
+        if not_modified:
+            response.status = 304
+            response.body = ""
+        else:
+            response.body = gzipped or self.body
+        return response
+
+    def not_modified(self, headers):
+        """
+        Check if the conditional request with the given *headers*
+        may be answered with "304 Not Modified".
+        """
+        if_none_match = headers.get("If-None-Match")
+        if if_none_match is not None:
+            # If-Modified-Since is ignored if If-None-Match is present
+            if if_none_match.strip() == "*":
+                return True
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            # Weak comparison, as required for If-None-Match
+            tags = [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+            return self.etag in tags or self._gzip_etag in tags
+        since = headers.get("If-Modified-Since")
+        if since is None:
+            return False
+        since = parsedate_tz(since)
+        if since is None:
+            return False
+        try:
+            return mktime_tz(since) >= self.last_modified
+        except (OverflowError, ValueError):
+            return False
+
+
+def _accepts_gzip(accept_encoding):
+    if not accept_encoding:
+        return False
+    for coding in accept_encoding.split(","):
+        params = coding.split(";")
+        if params[0].strip().lower() not in ("gzip", "x-gzip"):
+            continue
+        for param in params[1:]:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+class EncodedHeaders(Headers):
+    """
+    Response headers that are (mostly) encoded in advance. When 
+    the headers are sent, the ``Date`` header and the headers set
+    on this object are appended to the pre-encoded headers. Headers 
+    that are part of the pre-encoded headers or whose names are 
+    given in *omitted* are not appended.
+    """
+
+    def __init__(self, encoded, omitted=()):
+        super(EncodedHeaders, self).__init__()
+        self._encoded = encoded
+        self._skipped = set(name.lower() for name in omitted)
+        self._skipped.add("date")
+        for line in encoded.split("\r\n"):
+            if line:
+                self._skipped.add(line.split(":", 1)[0].lower())
+
+    def __str__(self):
+        parts = [self._encoded, "Date: ", http_date(), "\r\n"]
+        for name, value in self.items():
+            if name.lower() not in self._skipped:
+                parts.append("%s: %s\r\n" % (name, value))
+        parts.append("\r\n")
+        return "".join(parts)
+
+
+class StaticResponses(BaseComponent):
+    """
+    This component answers GET and HEAD requests for static documents
+    before they are dispatched to controllers. It must be registered
+    with the same channel as the dispatcher.
+
+    Components provide static documents with an attribute 
+    ``static_documents``, a dict that maps paths to functions
+    returning the :class:`StaticDocument` for the path (or ``None``
+    if the request is to be dispatched as usual). The documents
+    are looked up when the component or one of its ancestors is
+    registered. They are removed when the component or one of its 
+    ancestors is unregistered.
+    """
+
+    channel = "web"
+
+    def __init__(self, channel=channel):
+        super(StaticResponses, self).__init__(channel=channel)
+        # Maps paths to (provider, function)
+        self._documents = dict()
+        # Maps providers to their paths
+        self._provider_paths = dict()
+
+    def __len__(self):
+        return len(self._documents)
+
+    @handler("registered", channel="*")
+    def _on_registered(self, component, manager):
+        for provider in flatten(component):
+            documents = getattr(provider, "static_documents", None)
+            if not documents:
+                continue
+            for path, document in documents.items():
+                self._documents[path] = (provider, document)
+            self._provider_paths[provider] = list(documents.keys())
+
+    @handler("prepare_unregister", channel="*")
+    def _on_prepare_unregister(self, event, component):
+        for provider in flatten(component):
+            for path in self._provider_paths.pop(provider, ()):
+                entry = self._documents.get(path)
+                if entry is not None and entry[0] is provider:
+                    del self._documents[path]
+
+    @handler("request", priority=1.0)
+    def _on_request(self, event, request, response, peer_cert=None):
+        if request.method not in ("GET", "HEAD"):
+            return
+        entry = self._documents.get(request.path)
+        if entry is None:
+            return
+        document = entry[1]()
+        if document is None:
+            return
+        # Don't dispatch
+        event.stop()
+        return document.respond(request, response)
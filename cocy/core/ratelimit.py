@@ -0,0 +1,77 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from time import time
+from collections import OrderedDict
+
+
+class TokenBucket(object):
+    """
+    A token bucket that is refilled with *rate* tokens per second up
+    to a maximum of *capacity* tokens.
+    """
+    __slots__ = ("rate", "capacity", "_tokens", "_stamp")
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._stamp = time() if now is None else now
+
+    def consume(self, amount=1, now=None):
+        """
+        Take *amount* tokens from the bucket. Returns ``False`` (and
+        takes nothing) if there are not enough tokens.
+        """
+        now = time() if now is None else now
+        tokens = min(self.capacity,
+                     self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        if tokens < amount:
+            self._tokens = tokens
+            return False
+        self._tokens = tokens - amount
+        return True
+
+
+class TokenBucketMap(object):
+    """
+    Token buckets with the same rate and capacity for a set of keys.
+    At most *max_keys* buckets are kept, the bucket used least
+    recently is discarded when a new one is needed.
+    """
+
+    def __init__(self, rate, capacity, max_keys=1024):
+        self.rate = rate
+        self.capacity = capacity
+        self._max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def consume(self, key, amount=1, now=None):
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity, now)
+            if len(self._buckets) >= self._max_keys:
+                self._buckets.popitem(last=False)
+        self._buckets[key] = bucket
+        return bucket.consume(amount, now)
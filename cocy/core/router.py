@@ -0,0 +1,221 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from circuits.core.events import Event
+from circuits.core.handlers import handler
+from circuits.core.utils import flatten
+from circuits.web.controllers import BaseController
+from circuits.web.processors import process
+from circuits.web.utils import parse_qs
+from circuits_bricks.web import ScopeDispatcher, ScopedChannel
+
+
+class PathTrie(object):
+    """
+    Maps paths to values. Paths are split into their segments and
+    stored in a prefix tree, so adding, removing and looking up a path
+    takes time proportional to the number of its segments, independent
+    of the number of paths stored.
+    """
+
+    def __init__(self):
+        # A node is [value, children]
+        self._root = [None, dict()]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def split(path):
+        return [part for part in path.split("/") if part]
+
+    def add(self, path, value):
+        node = self._root
+        for part in self.split(path):
+            node = node[1].setdefault(part, [None, dict()])
+        if node[0] is None:
+            self._size += 1
+        node[0] = value
+
+    def remove(self, path, value=None):
+        """
+        Remove the given path. If *value* is given, the path is only
+        removed if it is mapped to *value*.
+        """
+        nodes = [(None, self._root)]
+        for part in self.split(path):
+            child = nodes[-1][1][1].get(part)
+            if child is None:
+                return
+            nodes.append((part, child))
+        node = nodes[-1][1]
+        if node[0] is None or value is not None and node[0] is not value:
+            return
+        node[0] = None
+        self._size -= 1
+        # Prune nodes that have become empty
+        while len(nodes) > 1:
+            part, node = nodes.pop()
+            if node[0] is not None or node[1]:
+                break
+            del nodes[-1][1][1][part]
+
+    def get(self, path, default=None):
+        node = self._root
+        for part in self.split(path):
+            node = node[1].get(part)
+            if node is None:
+                return default
+        return default if node[0] is None else node[0]
+
+    def prefixes(self, parts):
+        """
+        Return the values of all paths that are prefixes of the path
+        given as list of segments, longest first, as list of
+        ``(value, remaining_parts)`` tuples.
+        """
+        node = self._root
+        matches = []
+        if node[0] is not None:
+            matches.append((node[0], 0))
+        for index, part in enumerate(parts):
+            node = node[1].get(part)
+            if node is None:
+                break
+            if node[0] is not None:
+                matches.append((node[0], index + 1))
+        return [(value, parts[used:]) for value, used in reversed(matches)]
+
+
+def _accepts_vpath(handlers, vpath):
+    args_no = len(vpath)
+    return all(len(h.args) == args_no or h.varargs
+               or (h.defaults is not None and args_no <= len(h.defaults))
+               for h in handlers)
+
+
+def _find_method(controller, method, parts):
+    # Same resolution as circuits.web.dispatchers.dispatcher.find_handlers
+    handlers = controller._handlers.get(method)
+    if handlers:
+        return handlers, method, parts, False
+    if parts:
+        candidates = [(parts[0], parts[1:]), ("index", parts)]
+    else:
+        candidates = [("index", parts)]
+    for name, vpath in candidates:
+        handlers = controller._handlers.get(name)
+        if handlers and (not vpath or _accepts_vpath(handlers, vpath)):
+            return handlers, name, vpath, name == "index"
+        name, vpath = "index", [name] + vpath
+        handlers = controller._handlers.get(name)
+        if handlers and (not vpath or _accepts_vpath(handlers, vpath)):
+            return handlers, name, vpath, True
+    return None
+
+
+class TrieDispatcher(ScopeDispatcher):
+    """
+    A :class:`circuits_bricks.web.ScopeDispatcher` that finds the
+    controller for a request using a :class:`PathTrie`. The time
+    needed to find the controller depends on the length of the
+    request's path only, not on the number of controllers. The trie
+    is updated when controllers are registered and when they (or
+    one of their ancestors) are unregistered.
+
+    If the controller has exactly one handler for the request, the
+    handler is invoked directly. This avoids the lookup of the
+    handlers for an event on the controller's channel, which
+    involves all components of the tree whenever the tree
+    has changed. Else, an event is fired on the controller's
+    channel as with the standard dispatcher.
+    """
+
+    def __init__(self, **kwargs):
+        super(TrieDispatcher, self).__init__(**kwargs)
+        self._trie = PathTrie()
+        # Maps controllers to their paths
+        self._controller_paths = dict()
+
+    def __len__(self):
+        return len(self._trie)
+
+    def _scoped_paths(self, c):
+        paths = set()
+        for hs in c._handlers.values():
+            for h in hs:
+                scoped_channel = h.channel or c.channel
+                if isinstance(scoped_channel, ScopedChannel) \
+                    and scoped_channel.scope == self.channel:
+                    paths.add(scoped_channel.path)
+        return paths
+
+    @handler("registered", channel="*", override=True)
+    def _on_registered(self, c, m):
+        # Controllers may have been registered with a component that
+        # was not yet part of the tree.
+        for component in flatten(c):
+            if not isinstance(component, BaseController):
+                continue
+            paths = self._scoped_paths(component)
+            if not paths:
+                continue
+            for path in paths:
+                self._trie.add(path, component)
+            self._controller_paths[component] = paths
+
+    @handler("unregistered", channel="*", override=True)
+    def _on_unregistered(self, c, m):
+        pass
+
+    @handler("prepare_unregister", channel="*")
+    def _on_prepare_unregister(self, event, c):
+        for component in flatten(c):
+            for path in self._controller_paths.pop(component, ()):
+                self._trie.remove(path, component)
+
+    @handler("request", priority=0.1, override=True)
+    def _on_request(self, event, req, res, peer_cert=None):
+        if peer_cert:
+            event.peer_cert = peer_cert
+
+        for controller, parts in self._trie.prefixes(PathTrie.split(req.path)):
+            found = _find_method(controller, req.method, parts)
+            if found is not None:
+                break
+        else:
+            return
+        handlers, name, vpath, index = found
+        if name != req.method:
+            req.index = index
+
+        event.kwargs = parse_qs(req.qs)
+        process(req, event.kwargs)
+        if vpath:
+            event.args += tuple(vpath)
+        if len(handlers) == 1:
+            # The value returned is the value of the request event
+            h = iter(handlers).next()
+            if getattr(h, "event", False):
+                return h(event, *event.args, **event.kwargs)
+            return h(*event.args, **event.kwargs)
+        return self.fire(Event.create(str(name), *event.args, **event.kwargs),
+                         controller.channel)
@@ -0,0 +1,168 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+import os
+import json
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class JournaledStore(object):
+    """
+    A persistent mapping from strings to strings that can only grow.
+
+    The mapping is loaded into memory completely when the store is
+    opened. New entries are collected and appended to the journal
+    file (one JSON encoded ``[key, value]`` per line) in batches of
+    *batch_size* entries or when :meth:`flush` is called. Every batch
+    is written with a single ``write`` and synced to disk.
+
+    Several processes may share a journal. The file is locked while
+    it is read or written, and entries appended by other processes
+    are read before a key is added or a batch is written. If two
+    processes add the same key, the entry written first is used
+    after the next start.
+
+    The journal is never truncated or removed. Lines that cannot be
+    decoded (e.g. an incomplete line left by a crash) are skipped and
+    counted in :attr:`errors`.
+    """
+
+    def __init__(self, path, batch_size=64):
+        self._path = path
+        self._batch_size = batch_size
+        self._entries = dict()
+        self._pending = []
+        # Position up to which the journal has been read
+        self._offset = 0
+        self.errors = 0
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0644)
+        with self._locked():
+            self._read_journal()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def pending(self):
+        """
+        The number of entries not yet written to the journal.
+        """
+        return len(self._pending)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def has_key(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        return self._entries[key]
+
+    def get(self, key, default=None):
+        return self._entries.get(key, default)
+
+    def setdefault(self, key, value):
+        """
+        Return the value stored for *key*. If there is no such value,
+        store *value* (and return it).
+        """
+        try:
+            return self._entries[key]
+        except KeyError:
+            pass
+        # Maybe another process has added the key meanwhile
+        with self._locked():
+            self._read_journal()
+        if key in self._entries:
+            return self._entries[key]
+        self._entries[key] = value
+        self._pending.append((key, value))
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+        return value
+
+    def flush(self):
+        """
+        Append the pending entries to the journal.
+        """
+        if not self._pending or self._fd is None:
+            return
+        data = "".join([json.dumps(entry) + "\n" for entry in self._pending])
+        with self._locked():
+            self._read_journal()
+            if os.fstat(self._fd).st_size > self._offset:
+                # Terminate an incomplete line left by a crash
+                data = "\n" + data
+            while data:
+                written = os.write(self._fd, data)
+                data = data[written:]
+            os.fsync(self._fd)
+            self._offset = os.fstat(self._fd).st_size
+        self._pending = []
+
+    def close(self):
+        if self._fd is None:
+            return
+        self.flush()
+        os.close(self._fd)
+        self._fd = None
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _read_journal(self):
+        # Read everything appended since the last invocation
+        os.lseek(self._fd, self._offset, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(self._fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        data = "".join(chunks)
+        # An incomplete last line is left for later
+        end = data.rfind("\n") + 1
+        for line in data[:end].splitlines():
+            if not line:
+                continue
+            try:
+                key, value = [item.encode("utf-8") 
+                              for item in json.loads(line)]
+            except (ValueError, TypeError, AttributeError):
+                self.errors += 1
+                continue
+            self._entries.setdefault(key, value)
+        self._offset += end
@@ -0,0 +1,131 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from time import time
+from math import ceil
+
+
+class TimerWheel(object):
+    """
+    A hierarchical timer wheel that keeps a large number of timeouts
+    with constant cost for adding, cancelling and expiring an entry.
+
+    Time is divided into ticks of *resolution* seconds. Level 0 of
+    the wheel has a slot for each of the next *slots* ticks, every
+    higher level has slots that cover *slots* times the range of a slot
+    of the level below. Entries are moved down ("cascaded") to a
+    lower level when their slot becomes current.
+
+    Entries are identified by a key. Scheduling an entry with a key
+    that is already used replaces the existing entry.
+    """
+
+    def __init__(self, resolution=0.25, slots=64, levels=4, now=None):
+        self._resolution = resolution
+        self._slots = slots
+        self._wheels = [[dict() for _ in range(slots)]
+                        for _ in range(levels)]
+        self._start = time() if now is None else now
+        self._tick = 0
+        # Maps keys to (level, slot) of the entry
+        self._entries = dict()
+
+    @property
+    def resolution(self):
+        return self._resolution
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def schedule(self, key, delay, payload):
+        """
+        Schedule *payload* to expire after *delay* seconds. The
+        expiry is rounded up to the next tick.
+        """
+        self.cancel(key)
+        expiry = self._tick + max(1, int(ceil(delay / self._resolution)))
+        self._place(key, expiry, payload)
+
+    def cancel(self, key):
+        """
+        Remove the entry with the given key. Returns the entry's
+        payload or ``None`` if there was no such entry.
+        """
+        location = self._entries.pop(key, None)
+        if location is None:
+            return None
+        level, slot = location
+        return self._wheels[level][slot].pop(key)[1]
+
+    def advance(self, now=None):
+        """
+        Advance the wheel to the given time and return the expired
+        entries as list of (key, payload) tuples in order of expiry.
+        """
+        now = time() if now is None else now
+        target = int((now - self._start) / self._resolution)
+        if not self._entries:
+            # Nothing to expire or cascade, skip the idle period
+            self._tick = max(self._tick, target)
+            return []
+        expired = []
+        while self._tick < target:
+            self._tick += 1
+            self._cascade()
+            slot = self._wheels[0][self._tick % self._slots]
+            if not slot:
+                continue
+            self._wheels[0][self._tick % self._slots] = dict()
+            for key, (expiry, payload) in slot.iteritems():
+                del self._entries[key]
+                expired.append((key, payload))
+        return expired
+
+    def _place(self, key, expiry, payload):
+        delta = expiry - self._tick
+        level = 0
+        span = self._slots
+        while delta >= span and level < len(self._wheels) - 1:
+            level += 1
+            span *= self._slots
+        if delta >= span:
+            # Beyond range, will be re-placed when cascaded
+            expiry_slot = self._tick + span - 1
+        else:
+            expiry_slot = expiry
+        slot = (expiry_slot // (span // self._slots)) % self._slots
+        self._wheels[level][slot][key] = (expiry, payload)
+        self._entries[key] = (level, slot)
+
+    def _cascade(self):
+        tick = self._tick
+        for level in range(1, len(self._wheels)):
+            if tick % (self._slots ** level) != 0:
+                return
+            index = (tick // (self._slots ** level)) % self._slots
+            slot = self._wheels[level][index]
+            if not slot:
+                continue
+            self._wheels[level][index] = dict()
+            for key, (expiry, payload) in slot.iteritems():
+                self._place(key, expiry, payload)
@@ -20,6 +20,7 @@
 """
 from cocy.soaplib.soap import from_soap
 from xml.etree import ElementTree
+from xml.etree.cElementTree import XMLParser
 from xml.etree.ElementTree import Element, SubElement, QName
 import cocy.soaplib
 
@@ -53,6 +54,120 @@ def parseSoapRequest(request):
     return soapAction, soapheader, payload
 
 
+class _NoFastPath(Exception):
+    pass
+
+
+_ENVELOPE = '{%s}Envelope' % cocy.soaplib.ns_soap_env
+_HEADER = '{%s}Header' % cocy.soaplib.ns_soap_env
+_BODY = '{%s}Body' % cocy.soaplib.ns_soap_env
+
+
+class _ActionBuilder(object):
+    """
+    Parser target that collects the action and its arguments
+    from a SOAP envelope while it is being parsed.
+    """
+
+    def __init__(self):
+        self.action = None
+        self.args = dict()
+        self._depth = 0
+        self._in_header = False
+        self._arg = None
+        self._text = []
+
+    def start(self, tag, attrib):
+        self._depth += 1
+        depth = self._depth
+        if self._in_header:
+            return
+        if "href" in attrib or "id" in attrib:
+            # Multi-reference values must be resolved by soaplib
+            raise _NoFastPath()
+        if depth == 1:
+            if tag != _ENVELOPE:
+                raise _NoFastPath()
+        elif depth == 2:
+            if tag == _HEADER:
+                # Headers are not used by UPnP
+                self._in_header = True
+            elif tag != _BODY:
+                raise _NoFastPath()
+        elif depth == 3:
+            if self.action is not None:
+                raise _NoFastPath()
+            self.action = tag
+        elif depth == 4:
+            self._arg = tag
+            self._text = []
+        else:
+            # Not a flat argument list
+            raise _NoFastPath()
+
+    def data(self, data):
+        if self._arg is not None:
+            self._text.append(data)
+
+    def end(self, tag):
+        if self._depth == 2:
+            self._in_header = False
+        elif self._depth == 4 and not self._in_header:
+            self.args[self._arg] = "".join(self._text) or None
+            self._arg = None
+        self._depth -= 1
+
+    def close(self):
+        pass
+
+
+def parseSoapAction(request):
+    """
+    Parse the SOAP request for a UPnP action in a single pass. Returns
+    a tuple with the namespace of the action, the action's name and
+    a dict that maps the argument names to their values.
+
+    UPnP actions use simple envelopes only. If the request
+    isn't such a simple envelope (i.e. if it uses multi-reference
+    values, attachments, an encoding other than UTF-8 or
+    structured arguments), it is parsed with
+    :func:`parseSoapRequest`.
+    """
+    contentType = request.headers.get("Content-Type", "")
+    params = contentType.split(";")
+    if params[0].strip().lower().startswith("multipart/"):
+        return _parseSoapAction(request)
+    for param in params[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset" and value.strip(' "').lower() \
+            not in ("utf-8", "utf8", "us-ascii", "ascii"):
+            return _parseSoapAction(request)
+    body = request.body.read()
+    builder = _ActionBuilder()
+    parser = XMLParser(target=builder)
+    try:
+        parser.feed(body)
+        parser.close()
+    except _NoFastPath:
+        builder.action = None
+    except SyntaxError:
+        builder.action = None
+    if builder.action is None or not builder.action.startswith("{"):
+        request.body.seek(0)
+        return _parseSoapAction(request)
+    action_ns, action = splitQTag(builder.action)
+    return action_ns, action, builder.args
+
+
+def _parseSoapAction(request):
+    payload = parseSoapRequest(request)[2]
+    action_ns, action = splitQTag(payload.tag)
+    action_args = dict()
+    for node in payload:
+        action_args[node.tag] = node.text
+    return action_ns, action, action_args
+
+
 def buildSoapResponse(response, body):
     # construct the soap response, and serialize it
     envelope = Element('{%s}Envelope' % cocy.soaplib.ns_soap_env)
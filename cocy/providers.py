@@ -56,15 +56,20 @@ class Manifest(object):
     :param description: a description of the device
     :type  description: string
 
+    :param icons: icons that represent the device
+    :type  icons: list of :class:`Icon`
+
     """
     def __init__(self, unique_id, display_name, full_name = None,
-                 manufacturer=None, model_number=None, description=None):
+                 manufacturer=None, model_number=None, description=None,
+                 icons=None):
         self._unique_id = unique_id
         self._display_name = display_name
         self._full_name = full_name
         self._manufacturer = manufacturer
         self._model_number = model_number
         self._description = description
+        self._icons = list(icons or [])
 
     @property
     def unique_id(self):
@@ -90,6 +95,43 @@ class Manifest(object):
     def description(self):
         return self._description
 
+    @property
+    def icons(self):
+        return list(getattr(self, "_icons", []))
+
+
+class Icon(object):
+    """
+    An icon that represents a provider.
+    
+    :param path: the path of the image file (PNG, GIF or JPEG)
+    :type path: string
+    
+    :param depth: the color depth of the image
+    :type depth: int
+    
+    :param scale: if ``True``, scaled down versions of the image
+                  with the sizes commonly used by clients are provided
+                  as well (requires PIL)
+    :type scale: bool
+    """
+    def __init__(self, path, depth=24, scale=True):
+        self._path = path
+        self._depth = depth
+        self._scale = scale
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def depth(self):
+        return self._depth
+
+    @property
+    def scale(self):
+        return self._scale
+
     
 class provider_updated(Event):
     pass
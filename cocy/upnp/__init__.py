@@ -35,6 +35,8 @@ DIDL_LITE_NS = "urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/"
 
 COCY_SERVICE_EXT = "urn:cocy-service-ext"
 
+XML_CONTENT_TYPE = 'text/xml; charset="utf-8"'
+
 SERVER_HELLO = (platform.system() + '/' + platform.release()
                 + " UPnP/1.1 CoCy/0.1")
 
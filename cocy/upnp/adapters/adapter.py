@@ -23,21 +23,24 @@ from xml.etree import ElementTree
 from xml.etree.ElementTree import Element, SubElement, QName
 from circuits_bricks.web.dispatchers.dispatcher import ScopedChannel
 from cocy.upnp import SSDP_DEVICE_SCHEMA, SSDP_SCHEMAS, UPNP_EVENT_NS,\
-    UPNP_SERVICE_ID_PREFIX, SERVER_HELLO
+    UPNP_SERVICE_ID_PREFIX, SERVER_HELLO, XML_CONTENT_TYPE
 from circuits.web.controllers import Controller, expose, BaseController
-from cocy.misc import parseSoapRequest, splitQTag, buildSoapResponse
+from cocy.misc import parseSoapAction, buildSoapResponse
 from cocy.upnp.device_server import UPnPError
-from email.utils import formatdate
+from cocy.core.document import StaticDocument, EncodedHeaders
 from circuits_bricks.core.timers import Timer
 from circuits.core.events import Event
 from circuits.core.handlers import handler
+from circuits.core.utils import flatten
 from inspect import getmembers, ismethod
 from circuits_bricks.web.client import Client, request
 from cocy.upnp.service import UPnPService
+from cocy.upnp.icons import icon_variants
 from circuits_bricks.app.logger import log
 import logging
 from cocy import misc
 
+
 class UPnPServiceError(Exception):
     
     def __init__(self, code):
@@ -77,7 +80,6 @@ class UPnPDeviceAdapter(BaseComponent, Queryable):
             self.services = services
             self.desc_gen = desc_gen
 
-    _service_registry = dict()
     _mapping = dict()
     _props = DeviceProperties("Undefined", 0, 0, 0, [], None)
     """
@@ -109,11 +111,10 @@ class UPnPDeviceAdapter(BaseComponent, Queryable):
         self._web_server_port = port
         # Get instance information about the provider
         manifest = provider.provider_manifest
-        if manifest.unique_id and uuid_map.has_key(manifest.unique_id):
-            self._uuid = uuid_map[manifest.unique_id]
+        if manifest.unique_id:
+            self._uuid = uuid_map.setdefault(manifest.unique_id, str(uuid4()))
         else:
             self._uuid = str(uuid4())
-            uuid_map[manifest.unique_id] = self._uuid
         # Generate a unique path that will be used to access this device
         self._path = "/" + self.uuid
         # Remember the configuration id
@@ -123,26 +124,68 @@ class UPnPDeviceAdapter(BaseComponent, Queryable):
         self._services = set()
         service_insts = []
         for (service_type, service_id, controller) in self._props.services:
-            if not UPnPDeviceAdapter._service_registry.has_key(service_type):
+            # Services are shared by all devices of the server
+            service = server.services.get(service_type)
+            if service is None:
                 try:
-                    service = UPnPService \
-                        (config_id, service_type).register(self) \
+                    service = UPnPService(config_id, service_type) \
                         .register(server)
-                except:
+                except (IOError, ElementTree.ParseError) as error:
+                    server.fire(log(logging.WARN, "Service " + service_type
+                                    + " not available: " + str(error)),
+                                "logger")
                     continue
-            else:
-                service = UPnPDeviceAdapter._service_registry[service_type]
+                server.services[service_type] = service
             self._services.add(service)
             service_insts.append((service, service_id))
             # Create an adapter that links this class's service with the web
             # component interface of circuits
             controller(self, self._path, service, service_id).register(self)
 
+        # Prepare the icons (once, they are served from memory)
+        self._icons = []
+        names = set()
+        for icon in manifest.icons:
+            try:
+                variants = icon_variants(icon)
+            except (EnvironmentError, ValueError) as error:
+                server.fire(log(logging.WARN, "Icon " + icon.path
+                                + " not available: " + str(error)), "logger")
+                continue
+            for variant in variants:
+                if variant.name not in names:
+                    names.add(variant.name)
+                    self._icons.append(variant)
+
         # Create an adapter that links this class with the web
         # component interface of circuits
         UPnPDeviceController(ScopedChannel("upnp-web", self._path),
                              self, config_id, props, service_insts) \
             .register(self)
+        # Handle the controllers' registered events while the adapter
+        # is not yet part of the tree. The tree learns about them from
+        # the adapter's registered event. Else, the handlers for each
+        # controller's channel would have to be looked up in the
+        # complete tree, which takes time quadratic in the number
+        # of devices when adding many of them.
+        while len(self):
+            self.flush()
+
+    def dispose(self):
+        """
+        Remove the adapter from the component tree and release
+        everything created for the device. Subscriptions to the 
+        device's services are cancelled.
+        """
+        for component in list(flatten(self)):
+            if isinstance(component, UPnPSubscription):
+                component.cancel()
+            elif isinstance(component, Timer):
+                # Timers stay scheduled unless unregistered explicitly
+                component.unregister()
+        # Services are shared and stay registered
+        self._services = set()
+        self.unregister()
 
     @property
     def provider(self):
@@ -164,6 +207,17 @@ class UPnPDeviceAdapter(BaseComponent, Queryable):
     def root_device(self):
         return True # TODO:
 
+    @property
+    def icons(self):
+        """
+        The icons of the device as list of 
+        :class:`cocy.upnp.icons.IconVariant`.
+        """
+        return list(getattr(self, "_icons", []))
+
+    def icon_url(self, icon):
+        return self._path + "/icons/" + icon.name
+
     @property
     def services(self):
         return getattr(self, "_services", None)
@@ -182,12 +236,25 @@ class UPnPDeviceController(Controller):
 
     def __init__(self, channel, adapter, config_id, props, service_insts):
         super(UPnPDeviceController, self).__init__(channel=channel);
+        self._adapter = adapter
+        self._props = props
+        self._service_insts = service_insts
+        # The description is generated when it is first requested
+        self._config_id = None
+        self._description = None
+
+    def _build_description(self, config_id):
         # Generate a device description for the device
-        desc = getattr(self, props.desc_gen)\
-            (adapter, config_id, props, service_insts)
+        desc = getattr(self, self._props.desc_gen)\
+            (self._adapter, config_id, self._props, self._service_insts)
         misc.set_ns_prefixes(desc, { "": SSDP_DEVICE_SCHEMA })
-        self.description = u"<?xml version='1.0' encoding='utf-8'?>" \
-            + ElementTree.tostring(desc, encoding="utf-8").decode("utf-8")
+        self._config_id = config_id
+        # Kept encoded, the description is sent unchanged until the
+        # configuration changes
+        self._description = StaticDocument \
+            ("<?xml version='1.0' encoding='utf-8'?>"
+             + ElementTree.tostring(desc, encoding="utf-8"),
+             XML_CONTENT_TYPE, config_id)
  
     def _common_device_desc(self, adapter, config_id, props, services):
         root = Element("{%s}root" % SSDP_DEVICE_SCHEMA,
@@ -212,6 +279,11 @@ class UPnPDeviceController(Controller):
                     = value
         SubElement(device, "{%s}UDN" % SSDP_DEVICE_SCHEMA).text \
             = "uuid:" + adapter.uuid
+        icons = adapter.icons
+        if icons:
+            iconList = SubElement(device, "{%s}iconList" % SSDP_DEVICE_SCHEMA)
+            for icon in icons:
+                self._describeIcon(adapter, iconList, icon)
         if services and len(services) > 0:
             serviceList = SubElement(device, 
                                      "{%s}serviceList" % SSDP_DEVICE_SCHEMA)
@@ -219,6 +291,16 @@ class UPnPDeviceController(Controller):
                 self._describeService(adapter, serviceList, service)
         return root
         
+    def _describeIcon(self, adapter, icon_list, icon):
+        element = SubElement(icon_list, "{%s}icon" % SSDP_DEVICE_SCHEMA)
+        for tag, value in [("mimetype", icon.mime_type),
+                           ("width", str(icon.width)),
+                           ("height", str(icon.height)),
+                           ("depth", str(icon.depth)),
+                           ("url", adapter.icon_url(icon))]:
+            SubElement(element, "{%s}%s" % (SSDP_DEVICE_SCHEMA, tag)).text \
+                = value
+
     def _describeService(self, adapter, service_list, service_tuple):
         (service_type, service_id) = service_tuple
         service = SubElement(service_list, "{%s}service" % SSDP_DEVICE_SCHEMA)
@@ -235,14 +317,51 @@ class UPnPDeviceController(Controller):
 
     @expose("description.xml")
     def description(self, *args):
-        self.response.headers["Content-Type"] = "text/xml"
-        return self.description
+        return self._current_description() \
+            .serve(self.request, self.response)
+
+    @expose("icons")
+    def icons(self, name):
+        for icon in self._adapter.icons:
+            if icon.name == name:
+                return icon.document.serve(self.request, self.response)
+        return self.notfound()
+
+    def _current_description(self):
+        if self._adapter.config_id != self._config_id:
+            # Not generated yet or configuration has changed since 
+            # description was generated
+            self._build_description(self._adapter.config_id)
+        return self._description
+
+    @property
+    def static_documents(self):
+        """
+        The description and the icons are served by 
+        :class:`cocy.core.document.StaticResponses`.
+        """
+        documents = { self._adapter.path + "/description.xml": 
+                      self._current_description }
+        for icon in self._adapter.icons:
+            documents[self._adapter.icon_url(icon)] \
+                = (lambda document: lambda: document)(icon.document)
+        return documents
 
 
 class upnp_notification(Event):
     pass
 
 
+# The headers of an event message that are the same for all messages
+_NOTIFY_HEADERS = { "CONTENT-TYPE": XML_CONTENT_TYPE,
+                    "NT": "upnp:event",
+                    "NTS": "upnp:propchange" }
+
+# The headers of a response to a subscription that are the same for
+# all responses (Date is added by EncodedHeaders)
+_SUBSCRIBE_HEADERS = "Server: %s\r\nContent-Length: 0\r\n" % SERVER_HELLO
+
+
 class UPnPSubscription(BaseController):
     
     def __init__(self, callbacks, timeout, protocol):
@@ -252,6 +371,8 @@ class UPnPSubscription(BaseController):
         self._used_callback = 0
         self._client = Client(self._callbacks[self._used_callback], 
                               self.channel).register(self)
+        self._notify_headers = dict(_NOTIFY_HEADERS)
+        self._notify_headers["SID"] = self.sid
         self._protocol = protocol
         self._seq = 0
         if timeout > 0:
@@ -292,17 +413,25 @@ class UPnPSubscription(BaseController):
         self.fire(log(logging.DEBUG, "Notifying " 
                       + self._callbacks[self._used_callback]
                       + " about " + str(state_vars)), "logger")
+        headers = dict(self._notify_headers)
+        headers["SEQ"] = self._seq
         self.fire(request("NOTIFY", self._callbacks[self._used_callback], body,
-                          { "CONTENT-TYPE": "text/xml; charset=\"utf-8\"",
-                            "NT": "upnp:event",
-                            "NTS": "upnp:propchange",
-                            "SID": self.sid,
-                            "SEQ": self._seq }))
+                          headers))
         self._seq += 1
 
+    def cancel(self):
+        """
+        End the subscription. The connection used for sending
+        notifications is closed when the client is unregistered. 
+        """
+        for component in list(flatten(self)):
+            if isinstance(component, Timer):
+                component.unregister()
+        self.unregister()
+
     @handler("upnp_subs_end")
     def _on_subs_end(self):
-        self.unregister()
+        self.cancel()
         self.fire(log(logging.DEBUG, "Subscribtion for " + str(self._callbacks)
                       + " on " + self.parent.notification_channel
                       + " cancelled"), "logger")
@@ -333,22 +462,17 @@ class UPnPServiceController(BaseController):
         self._service = service
         self._notification_channel = adapter.uuid + "/" \
             + service_id + "/notifications"
+        @handler("provider_updated", channel=adapter.provider.channel)
+        def _on_provider_updated_handler(self, provider, changed):
+            if provider != adapter.provider:
+                return
+            self._on_provider_updated(changed)
+        self.addHandler(_on_provider_updated_handler)
 
     @property
     def notification_channel(self):
         return getattr(self, "_notification_channel", None)
 
-    @handler("registered")
-    def _on_registered(self, component, parent):
-        if component != self:
-            return
-        @handler("provider_updated", channel=self.parent.provider.channel)
-        def _on_provider_updated_handler(self, provider, changed):
-            if provider != self.parent.provider:
-                return
-            self._on_provider_updated(changed)
-        self.addHandler(_on_provider_updated_handler)
-            
     def _on_provider_updated(self, changed):
         state_vars = dict()
         for name, method in getmembers \
@@ -360,11 +484,7 @@ class UPnPServiceController(BaseController):
 
     @expose("control")
     def _control(self, *args):
-        payload = parseSoapRequest(self.request)[2]
-        action_ns, action = splitQTag(payload.tag)
-        action_args = dict()
-        for node in payload:
-            action_args[node.tag] = node.text
+        action_ns, action, action_args = parseSoapAction(self.request)
         method = getattr(self, action, None)
         if method is None or not getattr(method, "_is_upnp_service", False):
             self.fire(log(logging.INFO, 'Action ' + action 
@@ -389,22 +509,24 @@ class UPnPServiceController(BaseController):
                 timeout = int(timeout)
             except ValueError:
                 timeout = 1800
-            self.response.headers["Date"] = formatdate(usegmt=True)
-            self.response.headers["Server"] = SERVER_HELLO
-            self.response.headers["Timeout"] = "Second-" + str(timeout)
             if "SID" in self.request.headers:
                 # renewal
                 sid = self.request.headers["SID"]
-                self.response.headers["SID"] = sid
                 self.fire(Event.create("upnp_subs_renewal", timeout), 
                           UPnPSubscription.sid2chan(sid))
-                return ""
-            callbacks = []
-            for cb in self.request.headers["CALLBACK"].split("<")[1:]:
-                callbacks.append(cb[:cb.rindex(">")])
-            subs = UPnPSubscription(callbacks, timeout, 
-                                    self.request.protocol).register(self)
-            self.response.headers["SID"] = subs.sid
+            else:
+                callbacks = []
+                for cb in self.request.headers["CALLBACK"].split("<")[1:]:
+                    callbacks.append(cb[:cb.rindex(">")])
+                sid = UPnPSubscription(callbacks, timeout, 
+                                       self.request.protocol) \
+                                       .register(self).sid
+            # The body is empty, circuits' default Content-Type is omitted
+            headers = EncodedHeaders("%sSID: %s\r\nTimeout: Second-%d\r\n" 
+                                     % (_SUBSCRIBE_HEADERS, sid, timeout),
+                                     ("Content-Type",))
+            headers.update(self.response.headers)
+            self.response.headers = headers
             return ""
         elif self.request.method == "UNSUBSCRIBE":
             sid = self.request.headers["SID"]
@@ -0,0 +1,252 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+import sys
+import time
+from argparse import ArgumentParser
+from collections import OrderedDict
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from circuits.core.events import Event
+from circuits.core.manager import Manager
+from circuits_bricks.core.timers import Timer
+from circuits_bricks.app.config import config_value
+from cocy.upnp.ssdp import SSDPTranceiver
+from cocy.upnp.ssdp_message import parse_ssdp_message, M_SEARCH, NOTIFY,\
+    RESPONSE
+
+_KINDS = (NOTIFY, RESPONSE, M_SEARCH)
+
+
+class ssdp_census_report(Event):
+    pass
+
+
+class SSDPCensus(BaseComponent):
+    """
+    Passively records all SSDP messages received on the ``ssdp`` channel,
+    i.e. all messages received by a :class:`SSDPTranceiver`. Messages
+    are counted as they arrive on the network, before the receiver
+    drops duplicates or rate limits searches.
+
+    The memory used is bounded. Message rates are computed from
+    per-second counters for the last *window* seconds. Information
+    about at most *max_devices* devices and *max_usns* USNs is kept,
+    the entries not updated for the longest time are discarded when
+    these limits are reached. The top talkers (sources of most
+    messages) are tracked with the "space saving" algorithm
+    using *max_talkers* counters.
+
+    If *report_interval* is given, a report with the *top* devices and
+    talkers is written to *out* every *report_interval* seconds.
+    """
+
+    channel = "ssdp"
+
+    def __init__(self, window=60, max_devices=4096, max_usns=16384,
+                 max_talkers=32, report_interval=None, top=10,
+                 out=sys.stdout, channel=channel):
+        super(SSDPCensus, self).__init__(channel=channel)
+        self._window = window
+        self._max_devices = max_devices
+        self._max_usns = max_usns
+        self._max_talkers = max_talkers
+        self._top = top
+        self._out = out
+        self._started = time.time()
+        # Ring of [second, notify, response, search] counters
+        self._ring = [[None, 0, 0, 0] for _ in range(window)]
+        self._totals = dict([(kind, 0) for kind in _KINDS])
+        self._invalid = 0
+        # Maps device uuid to [max_age, messages, last_seen, location]
+        self._devices = OrderedDict()
+        self._devices_dropped = 0
+        self._usns = OrderedDict()
+        self._usns_dropped = 0
+        # Maps source address to [count, overestimation]
+        self._talkers = dict()
+        if report_interval:
+            Timer(report_interval, ssdp_census_report(), self.channel,
+                  persist=True).register(self)
+
+    @handler("read")
+    def _on_read(self, address, data):
+        self.record(address, data)
+
+    def record(self, address, data, now=None):
+        """
+        Add the given datagram received from *address* to the census.
+        """
+        now = time.time() if now is None else now
+        msg = parse_ssdp_message(data)
+        if msg is None:
+            self._invalid += 1
+            return
+        kind = msg.method
+        self._totals[kind] += 1
+        second = int(now)
+        slot = self._ring[second % self._window]
+        if slot[0] != second:
+            slot[:] = [second, 0, 0, 0]
+        slot[1 + _KINDS.index(kind)] += 1
+        self._count_talker(address[0])
+        if kind == M_SEARCH:
+            return
+        usn = msg.usn
+        if usn is None:
+            return
+        self._touch(self._usns, usn, None, self._max_usns, "_usns_dropped")
+        device = self._touch(self._devices, usn.split("::")[0],
+                             [None, 0, now, None], self._max_devices,
+                             "_devices_dropped")
+        device[1] += 1
+        device[2] = now
+        if msg.max_age is not None:
+            device[0] = msg.max_age
+        if msg.location is not None:
+            device[3] = msg.location
+
+    def _touch(self, entries, key, initial, max_entries, dropped):
+        # Moves the entry for key to the end (creating it if necessary)
+        value = entries.pop(key, initial)
+        if len(entries) >= max_entries:
+            entries.popitem(last=False)
+            setattr(self, dropped, getattr(self, dropped) + 1)
+        entries[key] = value
+        return value
+
+    def _count_talker(self, source):
+        talkers = self._talkers
+        entry = talkers.get(source)
+        if entry is not None:
+            entry[0] += 1
+            return
+        if len(talkers) < self._max_talkers:
+            talkers[source] = [1, 0]
+            return
+        # Replace the source with the least messages
+        victim = min(talkers, key=lambda t: talkers[t][0])
+        count = talkers.pop(victim)[0]
+        talkers[source] = [count + 1, count]
+
+    def snapshot(self, now=None, top=10):
+        """
+        Return the current state of the census as a dict.
+        """
+        now = time.time() if now is None else now
+        second = int(now)
+        span = min(self._window, max(1, second - int(self._started)))
+        sums = [0, 0, 0]
+        for slot in self._ring:
+            if slot[0] is not None and second - span < slot[0] <= second:
+                for i in range(3):
+                    sums[i] += slot[1 + i]
+        devices = sorted(self._devices.items(),
+                         key=lambda item: item[1][1], reverse=True)[:top]
+        talkers = sorted(self._talkers.items(),
+                         key=lambda item: item[1][0], reverse=True)[:top]
+        return {
+            "rates": dict([(kind, sums[i] / float(span))
+                           for i, kind in enumerate(_KINDS)]),
+            "totals": dict(self._totals),
+            "invalid": self._invalid,
+            "usns": len(self._usns),
+            "usns_dropped": self._usns_dropped,
+            "devices": len(self._devices),
+            "devices_dropped": self._devices_dropped,
+            "top_devices": [{ "uuid": uuid, "max_age": max_age,
+                              "messages": messages, "location": location,
+                              "idle": now - last_seen }
+                            for uuid, (max_age, messages, last_seen, location)
+                            in devices],
+            "top_talkers": [{ "address": address, "messages": count,
+                              "error": error }
+                            for address, (count, error) in talkers],
+        }
+
+    @handler("ssdp_census_report")
+    def _on_report(self):
+        self._out.write(format_report(self.snapshot(top=self._top)))
+        self._out.flush()
+
+
+def format_report(snapshot):
+    """
+    Format a snapshot of a :class:`SSDPCensus` as text.
+    """
+    rates = snapshot["rates"]
+    lines = ["--- %s" % time.strftime("%H:%M:%S"),
+             "Messages/s: notify %.2f, response %.2f, search %.2f"
+             % (rates[NOTIFY], rates[RESPONSE], rates[M_SEARCH]),
+             "Distinct USNs: %d%s, devices: %d%s"
+             % (snapshot["usns"],
+                " (+%d dropped)" % snapshot["usns_dropped"]
+                if snapshot["usns_dropped"] else "",
+                snapshot["devices"],
+                " (+%d dropped)" % snapshot["devices_dropped"]
+                if snapshot["devices_dropped"] else "")]
+    if snapshot["top_devices"]:
+        lines.append("Devices (messages, max-age, location):")
+        for device in snapshot["top_devices"]:
+            lines.append("  %-45s %7d %6s  %s"
+                         % (device["uuid"], device["messages"],
+                            device["max_age"], device["location"]))
+    if snapshot["top_talkers"]:
+        lines.append("Top talkers (messages):")
+        for talker in snapshot["top_talkers"]:
+            lines.append("  %-45s %7d"
+                         % (talker["address"], talker["messages"]))
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    """
+    Entry point of the ``cocy-ssdp-census`` command.
+    """
+    parser = ArgumentParser\
+        (description="Passively record the SSDP messages on the network.")
+    parser.add_argument("-i", "--interval", type=float, default=5,
+                        help="seconds between reports (default: 5)")
+    parser.add_argument("-w", "--window", type=int, default=60,
+                        help="seconds used to compute rates (default: 60)")
+    parser.add_argument("-t", "--top", type=int, default=10,
+                        help="number of devices and talkers reported "
+                        "(default: 10)")
+    parser.add_argument("--max-devices", type=int, default=4096,
+                        help="number of devices tracked (default: 4096)")
+    parser.add_argument("--interfaces",
+                        help="comma separated list of interface addresses")
+    args = parser.parse_args(argv)
+
+    manager = Manager()
+    SSDPTranceiver().register(manager)
+    SSDPCensus(window=args.window, max_devices=args.max_devices,
+               max_talkers=max(4 * args.top, 32),
+               report_interval=args.interval, top=args.top).register(manager)
+    if args.interfaces:
+        manager.fire(config_value("upnp", "interfaces", args.interfaces))
+    try:
+        manager.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
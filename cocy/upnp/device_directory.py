@@ -20,35 +20,133 @@
 """
 from circuits.core.components import BaseComponent
 from circuits.core.handlers import handler
-from cocy.upnp.ssdp import SSDPTranceiver, upnp_search_request, upnp_device_bye_bye
+from cocy.upnp.ssdp import SSDPTranceiver, upnp_search_request, \
+    upnp_device_bye_bye, ssdp_listen, ssdp_unlisten
 from circuits.core.utils import findroot, flatten
-from cocy.upnp import UPNP_ROOTDEVICE, SSDP_DEVICE_SCHEMA
+from cocy.upnp import UPNP_ROOTDEVICE, SSDP_DEVICE_SCHEMA, SSDP_PORT
 from circuits_bricks.web import Client
 from circuits_bricks.core.timers import Timer
 from circuits.web.client import request
+from circuits.core.events import Event
 import httplib
 from xml.etree.ElementTree import XML
-from urlparse import urljoin
+from urlparse import urljoin, urlparse
 from copy import copy
 
+class upnp_directory_search(Event):
+    pass
+
+
+class upnp_device_revalidate(Event):
+    pass
+
+
 class UPnPDeviceDirectory(BaseComponent):
+    """
+    The directory keeps track of the devices in the network. The
+    devices are found by searching for the types in ``search-targets``
+    (a comma separated list from the configuration section "upnp",
+    defaults to ``upnp:rootdevice``). Searching for specific device
+    or service types reduces the number of responses.
+
+    The search is repeated with an increasing interval. It starts with
+    ``search-interval-min`` seconds and is doubled after every search
+    that didn't find a new device, up to ``search-interval-max``
+    seconds. Finding a new device resets the interval to the minimum.
+
+    Known devices are revalidated with a unicast search sent to their
+    host if no notification has been received for three quarters of 
+    their max-age.
+
+    A device is known by its uuid. It is added to the directory
+    when a notification with one of the search targets is received,
+    and it is refreshed by such notifications. Notifications with
+    other types are dropped by the :class:`cocy.upnp.ssdp.SSDPReceiver`
+    and don't refresh the entry. If a notification has no max-age,
+    1800 seconds are assumed.
+    """
 
     channel = "upnp"
+    _default_max_age = 1800
 
     def __init__(self, *args, **kwargs):
         super(UPnPDeviceDirectory, self).__init__(*args, **kwargs)
+        self._search_targets = [UPNP_ROOTDEVICE]
+        self._search_mx = 1
+        self._search_interval_min = 4
+        self._search_interval_max = 900
+        self._search_interval = self._search_interval_min
+        self._search_timer = None
+        self._found = 0
+        # The known devices, mapped from their uuid
+        self._devices = dict()
+        # Whether the search targets have been registered as listened
+        self._listening = False
+
+    @handler("config_value", channel="configuration")
+    def _on_config_value(self, section, option, value):
+        if not section == "upnp":
+            return
+        if option == "search-targets":
+            if self._listening:
+                self.fire(ssdp_unlisten(self._search_targets))
+            self._search_targets = [target.strip() 
+                                    for target in value.split(",")
+                                    if target.strip()]
+            if self._listening:
+                self.fire(ssdp_listen(self._search_targets))
+        elif option == "search-interval-min":
+            self._search_interval_min = float(value)
+            self._search_interval = self._search_interval_min
+        elif option == "search-interval-max":
+            self._search_interval_max = float(value)
 
     @handler("started", channel="application")
     def _on_started(self, component):
-        self.fire(upnp_search_request(), "ssdp")
+        self._search()
+
+    @handler("upnp_directory_search")
+    def _on_directory_search(self):
+        # The timer has unregistered itself
+        self._search_timer = None
+        if self._found > 0:
+            self._search_interval = self._search_interval_min
+        else:
+            self._search_interval = min(2 * self._search_interval,
+                                        self._search_interval_max)
+        self._search()
+
+    def _search(self):
+        self._found = 0
+        for search_target in self._search_targets:
+            self.fire(upnp_search_request(search_target, self._search_mx),
+                      "ssdp")
+        if self._search_timer is not None:
+            self._search_timer.unregister()
+        self._search_timer = Timer\
+            (self._search_interval + self._search_mx, 
+             upnp_directory_search(), self.channel).register(self)
 
     @handler("upnp_device_alive", channel="*")
     def _on_device_alive \
         (self, location, notification_type, max_age, server, usn):
-        if notification_type == UPNP_ROOTDEVICE:
-            if not any(map(lambda c: isinstance(c, UPnPRootDevice) \
-                           and c.usn == usn, self.components.copy())):
-                UPnPRootDevice(location, max_age, usn).register(self)
+        if max_age is None:
+            # CACHE-CONTROL is required, but some devices omit it
+            max_age = self._default_max_age
+        uuid = usn.split("::", 1)[0]
+        device = self._devices.get(uuid)
+        if device is not None:
+            device.refresh(max_age)
+        elif notification_type in self._search_targets:
+            self._devices[uuid] = UPnPRootDevice \
+                (location, max_age, usn, notification_type).register(self)
+            self._found += 1
+
+    @handler("upnp_device_bye_bye", channel="*")
+    def _on_device_bye_bye(self, usn):
+        device = self._devices.pop(usn.split("::", 1)[0], None)
+        if device is not None:
+            device.remove()
 
     def register(self, parent):
         super(UPnPDeviceDirectory, self).register(parent)
@@ -56,12 +154,13 @@ class UPnPDeviceDirectory(BaseComponent):
         if not any([isinstance(c, SSDPTranceiver) \
                     for c in flatten(findroot(self))]):
             SSDPTranceiver().register(self.parent)
+        self.fire(ssdp_listen(self._search_targets))
+        self._listening = True
         return self
 
     @property
     def devices(self):
-        return filter(lambda c: isinstance(c, UPnPRootDevice) \
-                      and c.ready, self.components.copy())
+        return [device for device in self._devices.values() if device.ready]
 
 
 class IconInfo(object):
@@ -73,10 +172,12 @@ class IconInfo(object):
 
 class UPnPRootDevice(BaseComponent):
 
-    def __init__(self, location, max_age, usn):
+    def __init__(self, location, max_age, usn,
+                 notification_type=UPNP_ROOTDEVICE):
         super(UPnPRootDevice, self).__init__(channel=usn)
         self._location = location
         self._usn = usn
+        self._notification_type = notification_type
         self._ready = False
         self._comm_chan = "client." + usn
         self._client = Client(location, channel=self._comm_chan).register(self)
@@ -87,12 +188,16 @@ class UPnPRootDevice(BaseComponent):
         self.addHandler(_on_response)
         @handler("error", channel=self._comm_chan)
         def _on_error(self, *args, **kwargs):
-            self._client.close()
-            self.unregister()
+            # The device cannot be used, drop it like a device that
+            # has said byebye
+            self.fire(upnp_device_bye_bye(self._usn))
         self.addHandler(_on_error)
         self.fire(request("GET", self._location), self._client)
         self._expiry_timer \
             = Timer(max_age, upnp_device_bye_bye(usn)).register(self)
+        self._revalidation_timer \
+            = Timer(0.75 * max_age, upnp_device_revalidate(), self.channel,
+                    persist=True).register(self)
 
     def _initialize(self, xml_src):
         data = XML(xml_src)
@@ -111,14 +216,31 @@ class UPnPRootDevice(BaseComponent):
             self._icons.append(IconInfo(width, height, url))
         self._ready = True
 
-    @handler("upnp_device_alive")
-    def _on_device_alive \
-        (self, location, notification_type, max_age, server, usn):
+    def refresh(self, max_age):
+        """
+        Restart the expiry and revalidation timers after a notification
+        from the device has been received.
+        """
         self._expiry_timer.interval = max_age
         self._expiry_timer.reset()
+        self._revalidation_timer.interval = 0.75 * max_age
+        self._revalidation_timer.reset()
+
+    @handler("upnp_device_revalidate")
+    def _on_device_revalidate(self):
+        # Ask the device's host only instead of searching the network
+        host = urlparse(self._location).hostname
+        if host:
+            self.fire(upnp_search_request(self._notification_type,
+                                          address=(host, SSDP_PORT)), "ssdp")
 
-    @handler("upnp_device_bye_bye")
-    def _on_device_bye_bye (self, usn):
+    def remove(self):
+        """
+        Remove the device from the directory. The timers are 
+        unregistered explicitly, else they would stay scheduled.
+        """
+        self._expiry_timer.unregister()
+        self._revalidation_timer.unregister()
         self._client.close()
         self.unregister()
 
@@ -21,13 +21,19 @@
 from circuits.core.components import BaseComponent
 from circuits.core.handlers import handler
 from circuits.web.servers import BaseServer
-from circuits_bricks.web import ScopeDispatcher, ScopedChannel
+from circuits_bricks.web import ScopedChannel
 from circuits.web.controllers import BaseController, expose
 from circuits.core.events import Event
 from circuits.core.utils import findroot, flatten
-from cocy.upnp.ssdp import SSDPTranceiver
+from cocy.upnp.ssdp import SSDPTranceiver, notification_types,\
+    upnp_device_match, split_version
 from cocy.providers import Provider
 import anydbm
+from whichdb import whichdb
+from cocy.core.store import JournaledStore
+from cocy.core.document import StaticResponses
+from cocy.core.router import TrieDispatcher
+from circuits_bricks.core.timers import Timer
 import os
 from xml.etree.ElementTree import Element, QName, SubElement
 from cocy.upnp import UPNP_CONTROL_NS
@@ -38,7 +44,11 @@ import logging
 from circuits_bricks.app.logger import log
 
 
-class device_available(Event):
+class devices_available(Event):
+    """
+    Announce the devices passed as list. The announcements are spread
+    over time (see :class:`cocy.upnp.ssdp.SSDPSender`).
+    """
     pass
     
 
@@ -46,15 +56,31 @@ class device_unavailable(Event):
     pass
 
 
+class device_updated(Event):
+    pass
+
+
+class upnp_uuids_flush(Event):
+    pass
+
+
 class UPnPDeviceServer(BaseComponent):
     """
     This component keeps track of the :class:`cocy.providers.Provider` 
     instances and creates or removes the corresponding 
     :class:`cocy.upnp.device.UPnPDeviceAdapter` components.
     
-    Notifications are sent when a new device is added 
-    (:class:`cocy.upnp.ssdp.DeviceAvailable`) or removed
-    (:class:`cocy.upnp.ssdp.DeviceUnavailable`)
+    Notifications are sent when new devices are added 
+    (:class:`devices_available`) or removed
+    (:class:`device_unavailable`). Many providers are best added with 
+    :meth:`add_providers`. 
+    
+    Every device has its own configuration id. Adding or removing a
+    device doesn't change the descriptions of the other devices, so
+    their configuration ids are kept. If the description of a device
+    changes, its configuration id is incremented (see 
+    :meth:`update_devices`) and the change is announced with 
+    :class:`device_updated`.
     """
     channel = "upnp"
     
@@ -66,35 +92,57 @@ class UPnPDeviceServer(BaseComponent):
         # the server that will be announced by SSDP, so it has
         # no fixed port number.
         self.web_server = BaseServer(("", 0), channel="upnp-web").register(self)
+        # Static documents (descriptions) are answered without dispatching
+        StaticResponses(channel="upnp-web").register(self.web_server)
         # Dispatcher for "/upnp-web".
-        disp = ScopeDispatcher(channel="upnp-web").register(self.web_server)
+        disp = TrieDispatcher(channel="upnp-web").register(self.web_server)
         # Dummy root controller prevents requests for nested resources
         # from failing.
         DummyRoot().register(disp)
         
         # Initially empty list of providers
         self._devices = []
+        # Maps search targets (types without version) to the devices
+        # that match them
+        self._search_index = dict()
+        # Providers registered by add_providers
+        self._added_providers = set()
+        # Maps providers to the devices created for them
+        self._provider_devices = dict()
+        # Maps service types to the UPnPService components shared
+        # by the devices
+        self.services = dict()
         
-        # The configuration id, incremented every time the 
-        # configuration changes
+        # The configuration id of new devices (and of the service
+        # descriptions shared by the devices)
         self.config_id = 1
         
-        # Open the database for uuid persistence 
+        # Open the store for uuid persistence
+        self._uuid_db = JournaledStore(os.path.join(path, 'upnp_uuids.journal'))
+        if self._uuid_db.errors:
+            self.fire(log(logging.WARN, "Skipped %d invalid entries in %s"
+                          % (self._uuid_db.errors, self._uuid_db.path)),
+                      "logger")
+        if len(self._uuid_db) == 0:
+            self._import_uuids(os.path.join(path, 'upnp_uuids'))
+        self._uuid_flush_timer = None
+
+    def _import_uuids(self, legacy_path):
+        """
+        Take over the uuids from the database used by previous
+        versions. The database is left in place.
+        """
+        if not whichdb(legacy_path):
+            return
         try:
-            # Some people encounter problems on some boxes when opening 
-            # the db file
-            self._uuid_db = anydbm.open(os.path.join(path, 'upnp_uuids'), 'c')
-        except:
-            self.fire(log(logging.WARN, "Could not determine type db type of "
-                          + os.path.join(path, 'upnp_uuids')))
-            try:
-                os.remove(os.path.join(path, 'upnp_uuids'))
-                self._uuid_db = anydbm.open \
-                    (os.path.join(path, 'upnp_uuids'), 'c')
-            except:
-                self.fire(log(logging.WARN, "Giving up on "
-                          + os.path.join(path, 'upnp_uuids')))
-                
+            legacy_db = anydbm.open(legacy_path, 'r')
+            for key in legacy_db.keys():
+                self._uuid_db.setdefault(key, legacy_db[key])
+            legacy_db.close()
+            self._uuid_db.flush()
+        except Exception as e:
+            self.fire(log(logging.WARN, "Could not import uuids from %s: %s"
+                          % (legacy_path, str(e))), "logger")
 
     def register(self, parent):
         super(UPnPDeviceServer, self).register(parent)
@@ -104,35 +152,151 @@ class UPnPDeviceServer(BaseComponent):
             SSDPTranceiver().register(self.parent)
         return self
 
+    def add_providers(self, providers, parent=None):
+        """
+        Register the given providers with *parent* (defaults to this
+        component's parent) and publish them as UPnP devices. Compared
+        to registering the providers one by one, the new devices are
+        announced as a single paced burst (see :class:`devices_available`).
+        """
+        if parent is None:
+            parent = self.parent
+        devices = []
+        for provider in providers:
+            device = self._create_device(provider)
+            if device is not None:
+                devices.append(device)
+            # Already handled, see _on_registered
+            self._added_providers.add(provider)
+            provider.register(parent)
+        self._add_devices(devices)
+
     @handler("registered", channel="*")
     def _on_registered(self, component, manager):
         if not isinstance(component, Provider):
             return
+        if component in self._added_providers:
+            self._added_providers.discard(component)
+            return
+        device = self._create_device(component)
+        if device is not None:
+            self._add_devices([device])
+
+    def _create_device(self, provider):
         from cocy.upnp.adapters.adapter import UPnPDeviceAdapter
-        device = UPnPDeviceAdapter(self, component, self.config_id, \
+        device = UPnPDeviceAdapter(self, provider, self.config_id, \
                                    self._uuid_db, self.web_server.port)
         if not device.valid:
-            return
+            return None
+        if self._uuid_db.pending and self._uuid_flush_timer is None:
+            # Write new uuids in batches
+            self._uuid_flush_timer = Timer(1, upnp_uuids_flush(),
+                                           self.channel).register(self)
         device.register(self)
-        self._devices.append(device)
+        return device
+
+    def _add_devices(self, devices):
+        if not devices:
+            return
+        for device in devices:
+            self._devices.append(device)
+            self._provider_devices[device.provider] = device
+            self._index_device(device)
         if self._started:
-            self.fireEvent(device_available(device))
+            self.fireEvent(devices_available(devices))
 
-    @handler("unregister")
-    def _on_unregister(self, component, manager):
-        if not isinstance(component, Provider):
+    @handler("prepare_unregister", channel="*")
+    def _on_prepare_unregister(self, event, component):
+        # Usually a leaf (provider, timer, ...) is unregistered, so
+        # looking at the subtree is cheaper than looking at all devices
+        devices = [self._provider_devices[c] for c in flatten(component)
+                   if c in self._provider_devices]
+        self._remove_devices(devices)
+
+    def _remove_devices(self, devices):
+        """
+        Withdraw the given devices. The devices are announced as
+        unavailable. Their adapters are disposed of after the
+        announcement has been handled, because the byebye messages
+        are generated from the adapters' services.
+        """
+        if not devices:
             return
-        
+        for device in devices:
+            self._devices.remove(device)
+            self._provider_devices.pop(device.provider, None)
+            self._unindex_device(device)
+            if not self._started:
+                device.dispose()
+                continue
+            event = device_unavailable(device)
+            event.complete = True
+            self.fireEvent(event)
+
+    @handler("device_unavailable_complete")
+    def _on_device_unavailable_complete(self, unavailable, value):
+        unavailable.args[0].dispose()
+
+    @handler("upnp_uuids_flush")
+    def _on_uuids_flush(self):
+        self._uuid_flush_timer = None
+        self._uuid_db.flush()
+
+    @handler("upnp_device_search")
+    def _on_device_search(self, inquirer, search_target, mx=None, 
+                          interface=None):
+        if search_target == "ssdp:all":
+            devices = self._devices
+        else:
+            # Lower versions match as well, see SSDPDeviceDatagrams
+            devices = self._search_index.get(split_version(search_target)[0],
+                                             ())
+        for device in devices:
+            self.fire(upnp_device_match(device, inquirer, search_target, mx,
+                                        interface), "ssdp")
+
+    def update_devices(self, providers):
+        """
+        Inform the server that the descriptions of the devices for the
+        given providers have changed. These devices get a new
+        configuration id, which is announced with :class:`device_updated`.
+        """
+        for provider in providers:
+            device = self._provider_devices.get(provider)
+            if device is None:
+                continue
+            device.config_id += 1
+            if self._started:
+                self.fireEvent(device_updated(device))
+
+    def _search_types(self, device):
+        # Types are indexed without version
+        return set([split_version(nt)[0]
+                    for nt, usn in notification_types(device)])
+
+    def _index_device(self, device):
+        for nt in self._search_types(device):
+            self._search_index.setdefault(nt, []).append(device)
+
+    def _unindex_device(self, device):
+        for nt in self._search_types(device):
+            devices = self._search_index.get(nt)
+            if devices is None or device not in devices:
+                continue
+            devices.remove(device)
+            if not devices:
+                del self._search_index[nt]
 
     @handler("started", channel="application")
     def _on_started (self, component):
         self._started = True
-        for device in self._devices:
-            self.fireEvent(device_available(device))
+        if self._devices:
+            self.fireEvent(devices_available(list(self._devices)))
 
     @handler("stopped", channel="*", priority=100, filter=True)
     def _on_stopped(self, event, component):
         if not self._started:
+            self._uuid_db.flush()
             return
         self._started = False
         for device in self._devices:
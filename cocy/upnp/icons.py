@@ -0,0 +1,145 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+import os
+import struct
+from StringIO import StringIO
+from threading import Lock
+from cocy.core.document import StaticDocument
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# The sizes that control points commonly look for
+ICON_SIZES = (48, 120)
+# Icons don't change while the server is running
+ICON_MAX_AGE = 365 * 24 * 3600
+
+_EXTENSIONS = { "image/png": "png", "image/gif": "gif", "image/jpeg": "jpg" }
+
+
+class IconVariant(object):
+    """
+    An icon as announced in a device description, i.e. with
+    a given size. The image is available as :attr:`document`.
+    """
+
+    def __init__(self, width, height, depth, document):
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.document = document
+
+    @property
+    def mime_type(self):
+        return self.document.content_type
+
+    @property
+    def name(self):
+        """
+        The name used in the icon's URL.
+        """
+        return "%dx%d.%s" % (self.width, self.height,
+                             _EXTENSIONS[self.mime_type])
+
+
+def image_info(data):
+    """
+    Return the MIME type, width and height of the PNG, GIF or JPEG
+    image *data*.
+
+    :raises ValueError: if the format of the image is not supported
+    """
+    if data[:8] == "\x89PNG\r\n\x1a\n" and data[12:16] == "IHDR":
+        width, height = struct.unpack(">II", data[16:24])
+        return "image/png", width, height
+    if data[:6] in ("GIF87a", "GIF89a"):
+        width, height = struct.unpack("<HH", data[6:10])
+        return "image/gif", width, height
+    if data[:2] == "\xff\xd8":
+        offset = 2
+        while offset + 9 <= len(data) and data[offset] == "\xff":
+            marker = ord(data[offset + 1])
+            length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+            # Start of frame markers, except DHT, JPG and DAC
+            if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                height, width = struct.unpack\
+                    (">HH", data[offset + 5:offset + 9])
+                return "image/jpeg", width, height
+            offset += 2 + length
+    raise ValueError("Unsupported image format")
+
+
+def _scaled(data, size):
+    image = Image.open(StringIO(data))
+    if image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+        image = image.convert("RGBA")
+    image.thumbnail((size, size), Image.ANTIALIAS)
+    out = StringIO()
+    image.save(out, "PNG")
+    return out.getvalue()
+
+
+def _load_variants(icon):
+    with open(icon.path, "rb") as icon_file:
+        data = icon_file.read()
+    mime_type, width, height = image_info(data)
+    mtime = os.path.getmtime(icon.path)
+    variants = [IconVariant(width, height, icon.depth, StaticDocument
+                            (data, mime_type, int(mtime), mtime,
+                             ICON_MAX_AGE, compress=False))]
+    if not icon.scale or Image is None:
+        return variants
+    for size in ICON_SIZES:
+        if size >= max(width, height):
+            continue
+        scaled = _scaled(data, size)
+        scaled_type, scaled_width, scaled_height = image_info(scaled)
+        variants.append(IconVariant(scaled_width, scaled_height, icon.depth,
+                                    StaticDocument
+                                    (scaled, scaled_type, int(mtime), mtime,
+                                     ICON_MAX_AGE, compress=False)))
+    return variants
+
+
+_variants = dict()
+_variants_lock = Lock()
+
+def icon_variants(icon):
+    """
+    Return the variants of the given :class:`cocy.providers.Icon`:
+    the image itself and, if PIL is available, the image scaled down
+    to the sizes in :data:`ICON_SIZES` (if smaller than the image).
+    The variants are created once and shared by all devices
+    that use the same image file (until the file is modified).
+
+    :raises EnvironmentError: if the image cannot be read
+    :raises ValueError: if the format of the image is not supported
+    """
+    stat = os.stat(icon.path)
+    key = (os.path.abspath(icon.path), icon.depth, icon.scale)
+    stamp = (stat.st_mtime, stat.st_size)
+    with _variants_lock:
+        entry = _variants.get(key)
+        if entry is None or entry[0] != stamp:
+            entry = (stamp, _load_variants(icon))
+            _variants[key] = entry
+    return entry[1]
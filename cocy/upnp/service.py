@@ -20,10 +20,89 @@
 """
 from circuits.web.controllers import BaseController, expose
 import os
+from collections import OrderedDict
+from threading import Lock
 from circuits_bricks.web import ScopedChannel
 from xml.etree import ElementTree
-from cocy.upnp import UPNP_SERVICE_SCHEMA
+from cocy.upnp import UPNP_SERVICE_SCHEMA, XML_CONTENT_TYPE
 from cocy.misc import set_ns_prefixes
+from cocy.core.document import StaticDocument
+
+_service_dir = os.path.join(os.path.dirname(__file__), "services")
+
+
+class ServiceDescription(object):
+    """
+    A parsed service description (SCPD). The description is available 
+    serialized (as :attr:`text`), as :class:`cocy.core.document.StaticDocument`
+    for serving it (as :attr:`document`) and as tables. :attr:`actions` maps 
+    the name of each action to its arguments, a list of 
+    ``(name, direction, related_state_variable)`` tuples in the order 
+    of the description. :attr:`state_variables` maps the name of each 
+    state variable to a ``(data_type, send_events, default_value)`` 
+    tuple.
+    """
+
+    def __init__(self, service_type, ver, config_id):
+        self.type = service_type
+        self.ver = ver
+        self.config_id = config_id
+        with open(os.path.join(_service_dir, "%s_%s.xml" 
+                               % (service_type, ver))) as sfile:
+            sd = ElementTree.parse(sfile).getroot()
+        sd.set("configId", str(config_id))
+        # Some Android clients have problems with white spaces
+        for el in sd.getiterator():
+            if el.text:
+                el.text = el.text.strip()
+            if el.tail:
+                el.tail = el.tail.strip()
+        self.actions = dict()
+        for action in sd.iter(_qname("action")):
+            self.actions[_text(action, "name")] \
+                = [(_text(arg, "name"), _text(arg, "direction"),
+                    _text(arg, "relatedStateVariable"))
+                   for arg in action.iter(_qname("argument"))]
+        self.state_variables = dict()
+        for var in sd.iter(_qname("stateVariable")):
+            self.state_variables[_text(var, "name")] \
+                = (_text(var, "dataType"), var.get("sendEvents", "yes"),
+                   _text(var, "defaultValue"))
+        set_ns_prefixes(sd, { "": UPNP_SERVICE_SCHEMA })
+        self.text = ElementTree.tostring(sd)
+        self.document = StaticDocument(self.text, XML_CONTENT_TYPE, config_id)
+
+
+def _qname(tag):
+    return "{%s}%s" % (UPNP_SERVICE_SCHEMA, tag)
+
+def _text(element, tag):
+    return element.findtext(_qname(tag))
+
+
+_descriptions = OrderedDict()
+_descriptions_lock = Lock()
+_descriptions_max = 64
+
+def service_description(service_type, ver, config_id):
+    """
+    Return the :class:`ServiceDescription` for the given service
+    type and version with the given configuration id. The descriptions
+    are shared by all components of the process, the last
+    recently used descriptions are kept.
+    
+    :raises IOError: if there is no description for the service
+    :raises ElementTree.ParseError: if the description is invalid
+    """
+    key = (service_type, str(ver), config_id)
+    with _descriptions_lock:
+        desc = _descriptions.pop(key, None)
+        if desc is None:
+            desc = ServiceDescription(service_type, ver, config_id)
+        _descriptions[key] = desc
+        if len(_descriptions) > _descriptions_max:
+            _descriptions.popitem(last=False)
+    return desc
 
 
 class UPnPService(BaseController):
@@ -37,11 +116,12 @@ class UPnPService(BaseController):
     that return the description as XML text.    
     The URL for accessing a device's service description is part of the
     information provided for the device.
+    
+    A service is shared by all devices that support it.
     """
 
     channel = None
     _template_dir = os.path.join(os.path.dirname(__file__), "templates")
-    _service_dir = os.path.join(os.path.dirname(__file__), "services")
 
     def __init__(self, config_id, type_ver):
         """
@@ -52,6 +132,8 @@ class UPnPService(BaseController):
         
         :param type: the service type
         :param ver: the service version
+        :raises IOError: if there is no description for the service
+        :raises ElementTree.ParseError: if the description is invalid
         """
         self._type, self._ver = type_ver.split(":", 1)
         self._path = "/%s_%s" % (self._type, self._ver)
@@ -59,18 +141,17 @@ class UPnPService(BaseController):
         # Now call super as only now the channel is known and this classes
         # handlers will be registered properly
         super(UPnPService, self).__init__();
-        sfile = open(os.path.join(self._service_dir, 
-                                  "%s_%s.xml" % (self._type, self._ver)))
-        sd = ElementTree.parse(sfile).getroot()
-        sd.set("configId", str(config_id))
-        # Some Android clients have problems with white spaces
-        for el in sd.getiterator():
-            if el.text:
-                el.text = el.text.strip()
-            if el.tail:
-                el.tail = el.tail.strip()
-        set_ns_prefixes(sd, { "": UPNP_SERVICE_SCHEMA })
-        self._description = ElementTree.tostring(sd)
+        self.config_id = config_id
+        # Fail now if the description is missing or invalid
+        self.description
+
+    @property
+    def description(self):
+        """
+        The :class:`ServiceDescription` for the current configuration.
+        It is loaded when it is first needed.
+        """
+        return service_description(self._type, self._ver, self.config_id)
 
     @property
     def type(self):
@@ -84,7 +165,15 @@ class UPnPService(BaseController):
     def description_url(self):
         return self._path + "/service.xml" 
 
+    @property
+    def static_documents(self):
+        """
+        The description is served by 
+        :class:`cocy.core.document.StaticResponses`.
+        """
+        return { self.description_url: 
+                 lambda: self.description.document }
+
     @expose("service.xml")
     def _on_description(self, *args):
-        self.response.headers["Content-Type"] = "text/xml"
-        return self._description
+        return self.description.document.serve(self.request, self.response)
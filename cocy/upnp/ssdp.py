@@ -22,22 +22,122 @@ from circuits.core.components import BaseComponent
 from circuits.core.handlers import handler
 from circuits_bricks.net.sockets import UDPMCastServer
 import os
-from circuits.io.events import write
-from socket import gethostname, gethostbyname
+import socket
+from socket import gethostname, gethostbyname, error as SocketError
+from circuits.net.sockets import read, error
 import time
+import random
+from errno import EWOULDBLOCK, EAGAIN
+import heapq
 from circuits_bricks.core.timers import Timer
+from cocy.core.timerwheel import TimerWheel
+from cocy.core.ratelimit import TokenBucket, TokenBucketMap
+from cocy.core.cache import ExpiringSet
 from cocy.upnp import SSDP_ADDR, SSDP_PORT, SSDP_SCHEMAS, UPNP_ROOTDEVICE,\
     SERVER_HELLO
-from circuits_bricks.misc import component_query
 from circuits.core.events import Event
 from circuits.web.controllers import Controller
-from email.utils import formatdate
+from cocy.core.clock import http_date
 from circuits_bricks.app.logger import log
 import logging
+from cocy.upnp.ssdp_message import parse_ssdp_message, M_SEARCH, NOTIFY
+
+
+class ssdp_write_batch(Event):
+    """
+    Send all (address, data) pairs from the list passed as first argument.
+    The optional second argument selects the interface (see
+    :class:`SSDPTranceiver`) to send the datagrams on.
+    """
+    
+    def __init__(self, datagrams, interface=None):
+        super(ssdp_write_batch, self).__init__(datagrams, interface)
+
+
+def default_host_address():
+    """
+    Return the address of the host as obtained from its name or
+    ``None`` if the address cannot be determined.
+    """
+    hostaddr = gethostbyname(gethostname())
+    if hostaddr.startswith("127.") and not "." in gethostname():
+        try:
+            hostaddr = gethostbyname(gethostname() + ".")
+        except:
+            pass
+    return hostaddr
+
+
+class SSDPInterfaceServer(UDPMCastServer):
+    """
+    A multicast server that joins the SSDP group on a specific
+    (IPv4) interface only and sends its multicast datagrams from this
+    interface. ``read`` events fired by the server have an additional
+    attribute ``interface`` with the interface's address.
+    """
+
+    def __init__(self, interface, bind, **kwargs):
+        self._interface = interface
+        super(SSDPInterfaceServer, self).__init__(bind, **kwargs)
+
+    @property
+    def interface(self):
+        return self._interface
+
+    def _create_socket(self):
+        self._addrinfo = socket.getaddrinfo(self._bind[0], None)[0]
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            # Only receive datagrams for groups joined on this socket
+            # (Linux delivers datagrams for all groups by default)
+            sock.setsockopt(socket.IPPROTO_IP, 
+                            getattr(socket, "IP_MULTICAST_ALL", 49), 0)
+        except SocketError:
+            pass
+        sock.bind(('', self._bind[1]))
+        mreq = socket.inet_aton(self._bind[0]) \
+            + socket.inet_aton(self._interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                        socket.inet_aton(self._interface))
+        sock.setblocking(False)
+        return sock
+
+    def _read(self):
+        try:
+            data, address = self._sock.recvfrom(self._bufsize)
+            if data:
+                event = read(address, data)
+                event.interface = self._interface
+                self.fire(event)
+        except SocketError as e:
+            if e.args[0] in (EWOULDBLOCK, EAGAIN):
+                return
+            self.fire(error(self._sock, e))
+            self._close(self._sock)
 
 
 class SSDPTranceiver(BaseComponent):
     '''The SSDP protocol server component
+
+    By default, the component uses a single socket that joins the
+    SSDP multicast group on the default interface. Devices are announced
+    with the address obtained from the host's name. If the option 
+    ``interfaces`` in the configuration section "upnp" is set to a 
+    comma separated list of (IPv4) interface addresses, a socket is
+    created for each of these interfaces, and devices are announced
+    on every interface with the interface's address. 
+    
+    Every socket has its own write buffer, so a slow interface does not
+    stall the others.
+
+    Besides the ``write`` events handled by the underlying socket server,
+    the component accepts ``ssdp_write_batch`` events. These append a
+    list of datagrams to the server's write buffer with a single event
+    dispatch. The number of dispatches saved compared to sending the
+    datagrams with individual ``write`` events is available as
+    :attr:`dispatches_saved`.
     '''
 
     channel = "ssdp"
@@ -48,32 +148,211 @@ class SSDPTranceiver(BaseComponent):
         '''
         kwargs.setdefault("channel", self.channel)
         super(SSDPTranceiver, self).__init__(**kwargs)
+        self._server_kwargs = kwargs
 
-        # The underlying network connection, used by both the sender
-        # and the receiver 
-        self._server = UDPMCastServer((SSDP_ADDR, SSDP_PORT),
-                                     **kwargs).register(self)
-        self._server.setTTL(2)
+        # The underlying network connections, used by both the sender
+        # and the receiver, mapped from the interface address (None
+        # for the default interface)
+        server = UDPMCastServer((SSDP_ADDR, SSDP_PORT),
+                                **kwargs).register(self)
+        server.setTTL(2)
+        self._servers = { None: server }
 
         # Our associated SSDP message sender
-        SSDPSender().register(self)
+        self._sender = SSDPSender().register(self)
+        try:
+            self._sender.interfaces = { None: default_host_address() }
+        except Exception as e:
+            self.fire(log(logging.ERROR, "Failed to get host address: %s(%s)" \
+                          % (type(e), str(e))),
+                      "logger")
         
         # Our associated SSDP message receiver
         SSDPReceiver().register(self)
+        
+        self.dispatches_saved = 0
+
+    @property
+    def interfaces(self):
+        return self._servers.keys()
 
+    @handler("config_value", channel="configuration")
+    def _on_config_value(self, section, option, value):
+        if not section == "upnp" or option != "interfaces":
+            return
+        interfaces = [itf.strip() for itf in value.split(",") if itf.strip()]
+        if not interfaces or set(interfaces) == set(self._servers.keys()):
+            return
+        for server in self._servers.values():
+            server.close()
+            server.unregister()
+        self._servers = dict()
+        for interface in interfaces:
+            try:
+                server = SSDPInterfaceServer \
+                    (interface, (SSDP_ADDR, SSDP_PORT), 
+                     **self._server_kwargs).register(self)
+                server.setTTL(2)
+            except Exception as e:
+                self.fire(log(logging.ERROR, "Cannot use interface %s: %s(%s)"
+                              % (interface, type(e), str(e))), "logger")
+                continue
+            self._servers[interface] = server
+        self._sender.interfaces \
+            = dict([(itf, itf) for itf in self._servers.keys()])
+
+    @handler("ssdp_write_batch")
+    def _on_write_batch(self, datagrams, interface=None):
+        server = self._servers.get(interface)
+        if server is None:
+            return
+        # Queued as by write events, so that the datagrams are sent
+        # in order and without blocking
+        for address, data in datagrams:
+            server.write(address, data)
+        self.dispatches_saved += len(datagrams) - 1
+
+
+def notification_types(upnp_device):
+    """
+    Return the (NT, USN) pairs that are announced for the device. The
+    notification types are also the search targets that the device
+    responds to.
+    """
+    uuid = "uuid:" + upnp_device.uuid
+    result = []
+    # There is an extra announcement for root devices
+    if upnp_device.root_device:
+        result.append((UPNP_ROOTDEVICE, uuid + "::" + UPNP_ROOTDEVICE))
+    # Device UUID announcement
+    result.append((uuid, uuid))
+    # Device type announcement
+    nt = SSDP_SCHEMAS + ":device:" + upnp_device.type_ver
+    result.append((nt, uuid + "::" + nt))
+    # Service announcements
+    for service in upnp_device.services:
+        nt = SSDP_SCHEMAS + ":service:" + service.type_ver
+        result.append((nt, uuid + "::" + nt))
+    return result
+
+
+def split_version(notification_type):
+    """
+    Split a device or service type into the type without the version
+    and the version (as int). Other notification types are returned
+    unchanged with version ``None``.
+    """
+    base, _, version = notification_type.rpartition(":")
+    if version.isdigit() and (":device:" in base or ":service:" in base):
+        return base, int(version)
+    return notification_type, None
+
+
+class SSDPDatagram(object):
+    """
+    An SSDP message that has been rendered from a template and encoded
+    once. If the template contains a ``Date`` header, the message is
+    kept split at the position of the date, so that only the date
+    has to be filled in when the datagram is actually sent.
+    """
+    __slots__ = ("notification_type", "_head", "_tail")
+
+    DATE_MARK = "\0DATE\0"
+
+    def __init__(self, notification_type, message):
+        self.notification_type = notification_type
+        message = "\r\n".join(message.splitlines()) + "\r\n\r\n"
+        if isinstance(message, unicode):
+            message = message.encode("utf-8")
+        if self.DATE_MARK in message:
+            self._head, self._tail = message.split(self.DATE_MARK, 1)
+        else:
+            self._head, self._tail = message, None
+
+    def render(self, date):
+        if self._tail is None:
+            return self._head
+        return self._head + date + self._tail
+
+    def retarget(self, search_target):
+        """
+        Return a copy of this search result with *search_target* 
+        as ``ST`` header.
+        """
+        old = "\r\nST: %s\r\n" % self.notification_type
+        new = "\r\nST: %s\r\n" % search_target
+        datagram = SSDPDatagram.__new__(SSDPDatagram)
+        datagram.notification_type = search_target
+        datagram._head = self._head.replace(old, new, 1)
+        datagram._tail = None if self._tail is None \
+            else self._tail.replace(old, new, 1)
+        return datagram
+
+
+class SSDPDeviceDatagrams(object):
+    """
+    The complete set of SSDP messages (alive, byebye and search result)
+    for a device. The set is rendered for a given combination of
+    configuration id, location, max-age and boot id and must be replaced
+    when any of these change.
+    """
+    __slots__ = ("key", "messages", "_results")
+
+    def __init__(self, key, messages):
+        self.key = key
+        self.messages = messages
+        # Maps search targets to the matching search results
+        self._results = dict()
+
+    def results(self, search_target):
+        """
+        Return the search results that match *search_target*. As
+        required by the UPnP architecture, a device or service type
+        matches if the version searched for is lower than or equal to
+        the version announced. The results then have the search target
+        as ``ST``.
+        """
+        results = self._results.get(search_target)
+        if results is not None:
+            return results
+        target, version = split_version(search_target)
+        results = []
+        for datagram in self.messages["result"]:
+            nt, nt_version = split_version(datagram.notification_type)
+            if nt != target:
+                continue
+            if nt_version == version:
+                results.append(datagram)
+            elif version is not None and nt_version is not None \
+                and version < nt_version:
+                results.append(datagram.retarget(search_target))
+        results = tuple(results)
+        self._results[search_target] = results
+        return results
 
 
 class SSDPSender(BaseComponent):
     '''The SSDP Protocol sender component
+
+    Devices passed with a ``devices_available`` event and updates
+    of devices (``device_updated``) are announced at a rate of at most
+    ``announcement-rate`` devices per second (option from the
+    configuration section "upnp"), so announcing many devices doesn't
+    flood the network.
     '''
 
     channel = "ssdp"
     _template_dir = os.path.join(os.path.dirname(__file__), "templates")
     _template_cache = {}
-    _message_env = {}
     _message_expiry = 1800
     _boot_id = int(time.time())
-    _timers = dict()
+    _repeats = 3
+    _repeat_interval = 0.25
+    # Time until our own byebye messages have surely been looped back
+    _loopback_delay = 2
+    _msg_templates = { "available": "notify-available",
+                       "unavailable": "notify-unavailable",
+                       "result": "notify-result" }
 
     def __init__(self, channel=channel):
         '''
@@ -81,22 +360,41 @@ class SSDPSender(BaseComponent):
         '''
         super(SSDPSender, self).__init__(channel=channel)
 
-        # Setup the common entries in the dictionary that will be usd to
-        # fill the UPnP templates.
-        self._message_env['BOOTID'] = self._boot_id
-        self._message_env['SERVER'] = SERVER_HELLO
-        try:
-            self.hostaddr = gethostbyname(gethostname())
-            if self.hostaddr.startswith("127.") and not "." in gethostname():
-                try:
-                    self.hostaddr = gethostbyname(gethostname() + ".")
-                except:
-                    pass
-        except Exception as e:
-            self.fire(log(logging.ERROR, "Failed to get host address: %s(%s)" \
-                          % (type(e), str(e))),
-                      "logger")
-            
+        # The interfaces to send on, mapped to the address announced
+        self._interfaces = dict()
+        # The boot ids of devices that have been updated
+        self._boot_ids = dict()
+        # The pre-rendered messages, mapped from (uuid, interface)
+        self._datagrams = dict()
+        # Responses to M-SEARCH requests are sent by a scheduler
+        # for each interface
+        self._responses = dict()
+        self._search_response_rate = 100
+        self._announcement_rate = 200
+        # Announcements of all devices are driven by a single timer wheel
+        self._announcements = TimerWheel(resolution=self._repeat_interval)
+        self._announcement_timer = None
+        # The time until which paced announcements have been scheduled
+        self._paced_until = 0
+
+    @property
+    def interfaces(self):
+        """
+        The interfaces used for sending (see :class:`SSDPTranceiver`) 
+        as a dict that maps each interface to the host address that 
+        is announced in messages sent on the interface. 
+        """
+        return dict(self._interfaces)
+
+    @interfaces.setter
+    def interfaces(self, interfaces):
+        self._interfaces = dict(interfaces)
+        for key in [key for key in self._datagrams 
+                    if key[1] not in self._interfaces]:
+            del self._datagrams[key]
+        for interface in [itf for itf in self._responses 
+                          if itf not in self._interfaces]:
+            self._responses.pop(interface).unregister()
 
     @handler("config_value", channel="configuration")
     def _on_config_value(self, section, option, value):
@@ -104,126 +402,222 @@ class SSDPSender(BaseComponent):
             return
         if option == "max-age":
             self._message_expiry = int(value)
+        elif option == "search-response-rate":
+            self._search_response_rate = max(1, int(value))
+            for scheduler in self._responses.values():
+                scheduler.packets_per_second = self._search_response_rate
+        elif option == "announcement-rate":
+            self._announcement_rate = max(1, int(value))
 
     @handler("mgmt_controller_query")
     def _on_controller_query(self):
         return Controller()
 
-    @handler("device_available", channel="upnp")
-    def _on_device_available(self, event, upnp_device):
-        self._update_message_env(upnp_device)
-        self._send_device_messages(upnp_device, "available")
-        # Service announcements
-        for service in upnp_device.services:
-            self._send_service_message(upnp_device, service, "available")
-        # Handle repeats
-        if getattr(event, 'times_sent', 0) < 3:
-            self._timers[upnp_device.uuid] \
-                = Timer(0.25, event, *event.channels).register(self)
-            event.times_sent = getattr(event, 'times_sent', 0) + 1
-        else:
-            self._timers[upnp_device.uuid] \
-                = Timer(self._message_expiry / 4,
-                        event, *event.channels).register(self)
+    @handler("devices_available", channel="upnp")
+    def _on_devices_available(self, event, upnp_devices):
+        if self._announcement_timer is None:
+            # Wheel has been idle, delays must be relative to now
+            self._announcements.advance()
+        delays = self._paced_delays(len(upnp_devices))
+        for upnp_device, delay in zip(upnp_devices, delays):
+            self._announcements.cancel((upnp_device.uuid, "forget"))
+            self.fire(ssdp_own_device
+                      (upnp_device.uuid, 
+                       self._boot_ids.get(upnp_device.uuid, self._boot_id)))
+            # The first announcement is sent by the timer wheel as well
+            self._announcements.schedule \
+                (upnp_device.uuid, delay, (upnp_device, self._repeats))
+        self._arm_announcements()
    
+    @handler("device_updated", channel="upnp")
+    def _on_device_updated(self, event, upnp_device):
+        """
+        Inform about a changed configuration with ``ssdp:update``
+        messages (UPnP 1.1). The messages are sent by the timer wheel,
+        paced like the announcements of new devices.
+        """
+        if self._announcement_timer is None:
+            self._announcements.advance()
+        self._announcements.schedule((upnp_device.uuid, "update"), 
+                                     self._paced_delays(1)[0], upnp_device)
+        self._arm_announcements()
+
+    def _paced_delays(self, count):
+        """
+        Return the delays for sending *count* announcements without
+        exceeding the announcement rate, taking into account the
+        announcements that have already been scheduled.
+        """
+        now = time.time()
+        start = max(now, self._paced_until)
+        self._paced_until = start + float(count) / self._announcement_rate
+        return [start - now + float(index) / self._announcement_rate
+                for index in range(count)]
+
+    def _send_update(self, upnp_device):
+        """
+        Send the ``ssdp:update`` messages for the device. As required,
+        the messages announce the boot id that is used by the device
+        from now on.
+        """
+        boot_id = self._boot_ids.get(upnp_device.uuid, self._boot_id)
+        self.fire(ssdp_own_device(upnp_device.uuid, boot_id + 1))
+        date = http_date()
+        for interface in self._interfaces:
+            datagrams = self._render_datagrams \
+                (upnp_device, self._datagrams_key(upnp_device, interface),
+                 { "update": "notify-update" }, { "NEXTBOOTID": boot_id + 1 })
+            self.fire(ssdp_write_batch
+                      ([((SSDP_ADDR, SSDP_PORT), datagram.render(date))
+                        for datagram in datagrams.messages["update"]],
+                       interface))
+        self._boot_ids[upnp_device.uuid] = boot_id + 1
+
+    @handler("ssdp_announcement_tick")
+    def _on_announcement_tick(self):
+        for key, payload in self._announcements.advance():
+            if isinstance(key, tuple):
+                if key[1] == "update":
+                    self._send_update(payload)
+                else:
+                    self.fire(ssdp_own_device(key[0], None))
+                continue
+            uuid, (upnp_device, repeats) = key, payload
+            self._announce(upnp_device, "available")
+            if repeats > 0:
+                self._announcements.schedule \
+                    (uuid, self._repeat_interval, (upnp_device, repeats - 1))
+            else:
+                # Spread refreshes to avoid synchronized bursts
+                self._announcements.schedule \
+                    (uuid, random.uniform(0.5, 1) * self._message_expiry / 4,
+                     (upnp_device, 0))
+        self._arm_announcements()
+
+    def _arm_announcements(self):
+        if len(self._announcements) > 0:
+            if self._announcement_timer is None:
+                self._announcement_timer = Timer \
+                    (self._announcements.resolution, 
+                     ssdp_announcement_tick(), self.channel, persist=True) \
+                     .register(self)
+        elif self._announcement_timer is not None:
+            self._announcement_timer.unregister()
+            self._announcement_timer = None
+
     @handler("device_unavailable", channel="upnp")
     def _on_device_unavailable(self, event, upnp_device):
-        if self._timers.has_key(upnp_device.uuid):
-            self._timers[upnp_device.uuid].unregister()
-            del self._timers[upnp_device.uuid]
-        self._update_message_env(upnp_device)
-        self._send_device_messages(upnp_device, "unavailable")
-        # Service announcements
-        for service in upnp_device.services:
-            self._send_service_message(upnp_device, service, "unavailable")
+        self._announcements.cancel(upnp_device.uuid)
+        self._announcements.cancel((upnp_device.uuid, "update"))
+        self._announce(upnp_device, "unavailable")
+        # Forget the messages. The boot id is kept, it must not
+        # decrease if the device comes back.
+        for interface in self._interfaces:
+            self._datagrams.pop((upnp_device.uuid, interface), None)
+        # The receiver must still drop the byebye messages that are
+        # looped back
+        if self._announcement_timer is None:
+            self._announcements.advance()
+        self._announcements.schedule((upnp_device.uuid, "forget"),
+                                     self._loopback_delay, None)
+        self._arm_announcements()
    
     @handler("upnp_device_match")
-    def _on_device_match(self, upnp_device, inquirer, search_target):
-        self._update_message_env(upnp_device)
+    def _on_device_match(self, upnp_device, inquirer, search_target, 
+                         mx=None, interface=None):
+        if not interface in self._interfaces:
+            return
+        datagrams = self._device_datagrams(upnp_device, interface)
         if search_target == "ssdp:all":
-            self._send_device_messages(upnp_device, "result", inquirer)
+            results = datagrams.messages["result"]
         else:
-            if search_target == "upnp:rootdevice":
-                self._send_root_message(upnp_device, "notify-result", inquirer)
-            elif search_target.startswith("uuid:"):
-                self._send_uuid_message(upnp_device, "notify-result", inquirer)
-            elif search_target.startswith(SSDP_SCHEMAS + ":device:"):
-                self._send_device_message \
-                    (upnp_device, "notify-result", inquirer)
-            elif search_target.startswith(SSDP_SCHEMAS + ":service:"):
-                for service in upnp_device.services:
-                    if not search_target.startswith \
-                        (SSDP_SCHEMAS + ":service:" + service.type + ":"):
-                        continue
-                    self._send_service_message \
-                        (upnp_device, service, "result", inquirer)
+            results = datagrams.results(search_target)
+        if not results:
+            return
+        scheduler = self._responses.get(interface)
+        if scheduler is None:
+            scheduler = SSDPResponseScheduler \
+                (interface, self.channel, self._search_response_rate) \
+                .register(self)
+            self._responses[interface] = scheduler
+        scheduler.schedule(inquirer, results, mx)
             
     @handler("upnp_search_request")
-    def _on_search_request(self, event, search_target=UPNP_ROOTDEVICE, mx=1):
-        self._send_template("m-search-request", 
-                            { "ST": search_target, "MX": mx })
-        # Handle repeats
-        if getattr(event, 'times_sent', 0) < 3:
-            Timer(mx, event, *event.channels).register(self)
-            event.times_sent = getattr(event, 'times_sent', 0) + 1
-            
-    def _update_message_env(self, upnp_device):
-        self._message_env['CACHE-CONTROL'] = self._message_expiry
-        self._message_env['CONFIGID'] = upnp_device.config_id
-        self._message_env['DATE'] = formatdate(usegmt=True)
-        self._message_env['LOCATION'] = "http://" + self.hostaddr + ":" \
+    def _on_search_request(self, event, search_target=UPNP_ROOTDEVICE, mx=1,
+                           address=None):
+        """
+        Send a search request. Searches are sent once, repeating them
+        is up to the control point (see 
+        :class:`cocy.upnp.device_directory.UPnPDeviceDirectory`).
+        """
+        if address is None:
+            self._send_template("m-search-request", 
+                                { "ST": search_target, "MX": mx })
+            return
+        # Unicast searches have no MX and are sent on one interface only,
+        # routing is up to the operating system
+        message = SSDPDatagram(None, self._get_template("m-search-unicast")
+                               % { "HOST": "%s:%d" % address,
+                                   "ST": search_target }).render(None)
+        self.fire(ssdp_write_batch([(address, message)],
+                                   next(iter(self._interfaces), None)))
+
+    def _announce(self, upnp_device, msg_type):
+        date = http_date()
+        for interface in self._interfaces:
+            datagrams = self._device_datagrams(upnp_device, interface)
+            self.fire(ssdp_write_batch
+                      ([((SSDP_ADDR, SSDP_PORT), datagram.render(date))
+                        for datagram in datagrams.messages[msg_type]],
+                       interface))
+
+    def _device_datagrams(self, upnp_device, interface):
+        """
+        Return the pre-rendered messages for the given device and 
+        interface. The messages are (re-)rendered only if the device's
+        configuration id, its location, its boot id or the max-age has 
+        changed since they were last used.
+        """
+        key = self._datagrams_key(upnp_device, interface)
+        datagrams = self._datagrams.get((upnp_device.uuid, interface))
+        if datagrams is None or datagrams.key != key:
+            datagrams = self._render_datagrams \
+                (upnp_device, key, self._msg_templates)
+            self._datagrams[(upnp_device.uuid, interface)] = datagrams
+        return datagrams
+
+    def _datagrams_key(self, upnp_device, interface):
+        location = "http://" + self._interfaces[interface] + ":" \
             + str(upnp_device.web_server_port) + "/" + upnp_device.uuid \
             + "/description.xml"
-        
-    def _send_device_messages(self, upnp_device, msg_type, 
-                              to=(SSDP_ADDR, SSDP_PORT)):
-        template = "notify-%s" % msg_type
-        # There is an extra announcement for root devices
-        if upnp_device.root_device:
-            self._send_root_message(upnp_device, template, to)
-        # Device UUID announcement
-        self._send_uuid_message(upnp_device, template, to)
-        # Device type announcement
-        self._send_device_message(upnp_device, template, to)
-        
-    def _send_root_message(self, upnp_device, template, 
-                           to=(SSDP_ADDR, SSDP_PORT)):
-        self._message_env['NT'] = 'upnp:rootdevice'
-        self._message_env['USN'] = 'uuid:' + upnp_device.uuid \
-            + '::upnp:rootdevice'
-        self._send_template(template, self._message_env, to)
-
-    def _send_uuid_message(self, upnp_device, template, 
-                           to=(SSDP_ADDR, SSDP_PORT)):
-        self._message_env['NT'] = 'uuid:' + upnp_device.uuid
-        self._message_env['USN'] = 'uuid:' + upnp_device.uuid
-        self._send_template(template, self._message_env, to)
-
-    def _send_device_message(self, upnp_device, template, 
-                           to=(SSDP_ADDR, SSDP_PORT)):
-        self._message_env['NT'] = SSDP_SCHEMAS + ":device:" \
-            + upnp_device.type_ver
-        self._message_env['USN'] = 'uuid:' + upnp_device.uuid \
-            + "::" + self._message_env['NT']
-        self._send_template(template, self._message_env, to)
-
-    def _send_service_message(self, upnp_device, service, msg_type, \
-                              to=(SSDP_ADDR, SSDP_PORT)):
-        template = "notify-%s" % msg_type
-        self._message_env['NT'] = SSDP_SCHEMAS + ":service:" \
-            + service.type_ver
-        self._message_env['USN'] = 'uuid:' + upnp_device.uuid \
-            + "::" + self._message_env['NT']
-        self._send_template(template, self._message_env, to)
-        
+        return (upnp_device.config_id, location, self._message_expiry,
+                self._boot_ids.get(upnp_device.uuid, self._boot_id))
+
+    def _render_datagrams(self, upnp_device, key, templates, extra_env={}):
+        config_id, location, max_age, boot_id = key
+        env = { "BOOTID": boot_id,
+                "SERVER": SERVER_HELLO,
+                "CACHE-CONTROL": max_age,
+                "CONFIGID": config_id,
+                "DATE": SSDPDatagram.DATE_MARK,
+                "LOCATION": location }
+        env.update(extra_env)
+        messages = dict()
+        for msg_type, template_name in templates.items():
+            template = self._get_template(template_name)
+            datagrams = []
+            for nt, usn in notification_types(upnp_device):
+                env["NT"] = nt
+                env["USN"] = usn
+                datagrams.append(SSDPDatagram(nt, template % env))
+            messages[msg_type] = tuple(datagrams)
+        return SSDPDeviceDatagrams(key, messages)
+
     def _send_template(self, template_name, data, to=(SSDP_ADDR, SSDP_PORT)):
         template = self._get_template(template_name)
-        message = template % data
-        headers = ""
-        for line in message.splitlines():
-            headers = headers + line + "\r\n"
-        headers += "\r\n"
-        self.fireEvent(write(to, headers))
+        message = SSDPDatagram(None, template % data).render(None)
+        for interface in self._interfaces:
+            self.fire(ssdp_write_batch([(to, message)], interface))
                     
     def _get_template(self, name):
         if self._template_cache.has_key(name):
@@ -234,26 +628,133 @@ class SSDPSender(BaseComponent):
         return template
 
 
+class ssdp_announcement_tick(Event):
+    pass
+
+
+class ssdp_send_responses(Event):
+    pass
+
+
+class SSDPResponseScheduler(BaseComponent):
+    """
+    The scheduler delays the responses to M-SEARCH requests as required
+    by the UPnP architecture. Every inquirer's responses are sent
+    after a random delay within the request's MX. Responses to the same
+    inquirer that are scheduled while others are still pending are
+    combined with these and sent together. The total rate of
+    responses sent is limited to :attr:`packets_per_second` (set 
+    by the :class:`SSDPSender` from option ``search-response-rate`` 
+    in the configuration section "upnp").
+    
+    A scheduler handles the responses for a single interface. The
+    responses are sent with ``ssdp_write_batch`` events on *channel*.
+    The scheduler's own timer events use a channel of their own, so
+    that the schedulers of different interfaces don't wake up each other.
+    """
+
+    channel = "ssdp"
+    _max_mx = 5
+
+    def __init__(self, interface=None, channel=channel, 
+                 packets_per_second=100):
+        super(SSDPResponseScheduler, self).__init__\
+            (channel="%s-responses-%s" % (channel, interface))
+        self._interface = interface
+        self._send_channel = channel
+        self.packets_per_second = packets_per_second
+        self._tokens = self._burst
+        self._last_refill = time.time()
+        # Maps inquirers to [due time, pending datagrams, set of these]
+        self._pending = dict()
+        # Heap of (due time, inquirer)
+        self._queue = []
+        self._timer = None
+
+    @property
+    def _burst(self):
+        return max(1.0, self.packets_per_second / 10.0)
+
+    def schedule(self, inquirer, datagrams, mx):
+        """
+        Schedule the datagrams to be sent to the inquirer. *mx* is the
+        maximum delay in seconds as requested by the inquirer, or
+        ``None`` if the request had no MX header (unicast request).
+        """
+        if mx is None:
+            delay = 0
+        else:
+            delay = random.uniform(0, max(0, min(mx, self._max_mx)))
+        due = time.time() + delay
+        entry = self._pending.get(inquirer)
+        if entry is None:
+            self._pending[inquirer] = [due, list(datagrams), set(datagrams)]
+            heapq.heappush(self._queue, (due, inquirer))
+        else:
+            for datagram in datagrams:
+                if not datagram in entry[2]:
+                    entry[1].append(datagram)
+                    entry[2].add(datagram)
+            if due < entry[0]:
+                entry[0] = due
+                heapq.heappush(self._queue, (due, inquirer))
+        self._arm(time.time())
+
+    @handler("ssdp_send_responses")
+    def _on_send_responses(self):
+        self._timer = None
+        now = time.time()
+        self._tokens = min(self._burst, self._tokens + (now - self._last_refill)
+                           * self.packets_per_second)
+        self._last_refill = now
+        date = http_date()
+        batch = []
+        queue = self._queue
+        while queue and queue[0][0] <= now and self._tokens >= 1:
+            due, inquirer = queue[0]
+            entry = self._pending.get(inquirer)
+            if entry is None or entry[0] != due:
+                # Stale queue entry, superseded or already sent
+                heapq.heappop(queue)
+                continue
+            count = min(int(self._tokens), len(entry[1]))
+            for datagram in entry[1][:count]:
+                batch.append((inquirer, datagram.render(date)))
+            del entry[1][:count]
+            self._tokens -= count
+            if entry[1]:
+                break
+            heapq.heappop(queue)
+            del self._pending[inquirer]
+        if batch:
+            self.fire(ssdp_write_batch(batch, self._interface),
+                      self._send_channel)
+        self._arm(now)
+
+    def _arm(self, now):
+        if self._timer is not None or not self._queue:
+            return
+        delay = max(0, self._queue[0][0] - now)
+        if self._tokens < 1:
+            delay = max(delay, (1 - self._tokens) / self.packets_per_second)
+        self._timer = Timer(delay, ssdp_send_responses(), self.channel) \
+            .register(self)
+
+
 class upnp_device_match(Event):
     
-    def __init__(self, component, inquirer, search_target):
+    def __init__(self, component, inquirer, search_target, mx=None,
+                 interface=None):
         super(upnp_device_match, self)\
-            .__init__(component, inquirer, search_target)
+            .__init__(component, inquirer, search_target, mx, interface)
 
 
-class upnp_device_query(component_query):
+class upnp_device_search(Event):
     
-    def __init__(self, query_function, inquirer, search_target):
-        super(upnp_device_query, self).__init__(query_function)
-        self.name = super(upnp_device_query, self).name
-        self._inquirer = inquirer
-        self._search_target = search_target
-
-    def decide(self, component):
-        res = super(upnp_device_query, self).decide(component)
-        if res != None:
-            component.fire(upnp_device_match(component, self._inquirer, \
-                                           self._search_target), "ssdp")
+    def __init__(self, inquirer, search_target, mx=None, interface=None):
+        super(upnp_device_search, self).__init__\
+            (inquirer, search_target, mx, interface)
+
 
 class upnp_device_alive(Event):
     
@@ -271,79 +772,240 @@ class upnp_device_bye_bye(Event):
 
 
 class upnp_search_request(Event):
+    """
+    Search for devices with the given search target. The search is 
+    multicast with the given *mx* unless an *address* (host, port) is
+    passed as keyword argument. The search is then sent to this address
+    only (unicast M-SEARCH as defined by UPnP 1.1).
+    """
     
     def __init__(self, search_target=UPNP_ROOTDEVICE, mx=1, **kwargs):
         super(upnp_search_request, self).__init__(search_target, mx, **kwargs)
 
 
+class ssdp_listen(Event):
+    """
+    Register interest in the notifications (and search responses) with
+    the notification types passed as list. The :class:`SSDPReceiver`
+    fires :class:`upnp_device_alive` and :class:`upnp_device_bye_bye`
+    events for registered notification types only. Registering
+    ``ssdp:all`` makes the receiver fire the events for all types.
+    """
+    channels = ("ssdp",)
+
+    def __init__(self, notification_types):
+        super(ssdp_listen, self).__init__(notification_types)
+
+
+class ssdp_unlisten(Event):
+    """
+    Withdraw the interest in the notification types passed as list
+    that has been registered with :class:`ssdp_listen`. A type stays
+    registered until it has been withdrawn as often as it has been
+    registered.
+    """
+    channels = ("ssdp",)
+
+    def __init__(self, notification_types):
+        super(ssdp_unlisten, self).__init__(notification_types)
+
+
+class ssdp_own_device(Event):
+    """
+    Inform the :class:`SSDPReceiver` that the device with the given
+    uuid is announced by this process using the given boot id. 
+    A boot id ``None`` informs the receiver that the device is no
+    longer announced.
+    """
+    channels = ("ssdp",)
+
+    def __init__(self, uuid, boot_id):
+        super(ssdp_own_device, self).__init__(uuid, boot_id)
+
+
 class SSDPReceiver(BaseComponent):
+    """
+    The SSDP protocol receiver component. 
+    
+    M-SEARCH requests are subject to rate limiting, because
+    every request may cause a large number of responses. Each source
+    address may send ``ssdp-source-search-rate`` searches per second
+    (with bursts of twice this amount), and all sources together
+    ``ssdp-search-rate`` searches per second (options from the 
+    configuration section "upnp"). Searches that exceed these limits 
+    are dropped. 
+    
+    Notifications sent by the devices of this process are looped back
+    by the network. They are recognized by USN and BOOTID (see
+    :class:`ssdp_own_device`) and dropped. Responses to searches are passed on, even if they come
+    from a device of this process, so a local control point
+    can find local devices.
+
+    Notifications and search responses are passed on as events only
+    if their notification type has been registered with
+    :class:`ssdp_listen` (and not yet withdrawn with 
+    :class:`ssdp_unlisten`). A process without listeners doesn't parse
+    them at all.
+    
+    Devices usually send their notifications several times. Messages
+    that have already been received within the last 
+    ``ssdp-duplicate-ttl`` seconds (with the same USN, NTS, LOCATION 
+    and BOOTID) are dropped.
+    
+    The number of messages received and dropped is 
+    available as :attr:`counters`.
+    """
 
     channel = "ssdp"
 
     def __init__(self, channel = channel):
         super(SSDPReceiver, self).__init__(channel=channel)
+        self._source_limits = TokenBucketMap(5, 10)
+        self._search_limit = TokenBucket(50, 100)
+        # Recent messages, looked up by USN when a device says byebye
+        self._recent = ExpiringSet(5, index=lambda key: key[0])
+        # Notification types that listeners are interested in, mapped
+        # to the number of registrations
+        self._listened = dict()
+        # Maps the uuids of our own devices to the boot ids
+        # of their notifications
+        self._own_devices = dict()
+        self._counters = { "received": 0,
+                           "searches": 0,
+                           "searches_dropped_source": 0,
+                           "searches_dropped_global": 0,
+                           "own_dropped": 0,
+                           "unlistened_dropped": 0 }
+
+    @property
+    def counters(self):
+        counters = dict(self._counters)
+        counters["duplicates_dropped"] = self._recent.hits
+        counters["duplicates_passed"] = self._recent.misses
+        return counters
+
+    @handler("config_value", channel="configuration")
+    def _on_config_value(self, section, option, value):
+        if not section == "upnp":
+            return
+        if option == "ssdp-source-search-rate":
+            self._source_limits = TokenBucketMap(float(value), 
+                                                 2 * float(value))
+        elif option == "ssdp-search-rate":
+            self._search_limit = TokenBucket(float(value), 2 * float(value))
+        elif option == "ssdp-duplicate-ttl":
+            self._recent.ttl = float(value)
+
+    @handler("ssdp_listen")
+    def _on_listen(self, notification_types):
+        for notification_type in notification_types:
+            self._listened[notification_type] \
+                = self._listened.get(notification_type, 0) + 1
+
+    @handler("ssdp_unlisten")
+    def _on_unlisten(self, notification_types):
+        for notification_type in notification_types:
+            count = self._listened.get(notification_type, 0) - 1
+            if count > 0:
+                self._listened[notification_type] = count
+            else:
+                self._listened.pop(notification_type, None)
+
+    @handler("ssdp_own_device")
+    def _on_own_device(self, uuid, boot_id):
+        if boot_id is None:
+            self._own_devices.pop(uuid, None)
+            return
+        self._own_devices.setdefault(uuid, set()).add(boot_id)
+
+    def _is_own(self, msg):
+        uuid = msg.usn.split("::", 1)[0]
+        if uuid[:5].lower() != "uuid:":
+            return False
+        boot_ids = self._own_devices.get(uuid[5:])
+        return boot_ids is not None and msg.boot_id in boot_ids
+
+    def _is_listened(self, msg):
+        listened = self._listened
+        return "ssdp:all" in listened \
+            or msg.notification_type in listened
+
+    def _is_duplicate(self, msg):
+        headers = msg.headers
+        usn = msg.usn
+        sub_type = headers.get("NTS")
+        if not self._recent.add((usn, sub_type, headers.get("LOCATION"),
+                                 headers.get("BOOTID.UPNP.ORG"))):
+            return True
+        if sub_type == "ssdp:byebye":
+            # The device may come back immediately, make sure that
+            # its next alive message isn't dropped.
+            for key in self._recent.indexed(usn):
+                if key[1] != sub_type:
+                    self._recent.discard(key)
+        return False
+
+    def _search_allowed(self, address):
+        counters = self._counters
+        counters["searches"] += 1
+        now = time.time()
+        if not self._source_limits.consume(address[0], now=now):
+            counters["searches_dropped_source"] += 1
+            return False
+        if not self._search_limit.consume(now=now):
+            counters["searches_dropped_global"] += 1
+            return False
+        return True
 
     @handler("read")
-    def _on_read(self, address, data):
-        
-        def istartswith(line, prefix):
-            return line[0:len(prefix)].upper() == prefix
-
-        def parse_lines(lines):
-            ''' Helper function that parses the information and puts it in an
-                anonymous type.'''
-            res = type("", (), {})()
-            for line in lines:
-                if istartswith(line, "CACHE-CONTROL:"):
-                    s = line.split(":", 1)[1].strip()
-                    setattr(res, "max_age", int(s.split("=", 1)[1].strip()))
-                elif istartswith(line, "LOCATION:"):
-                    setattr(res, "location", line.split(":", 1)[1].strip())
-                elif istartswith(line, "NT:"):
-                    setattr(res, "notification_type", 
-                            line.split(":", 1)[1].strip())
-                elif istartswith(line, "ST:"):
-                    # Handle search responses like alive messages
-                    setattr(res, "notification_type", 
-                            line.split(":", 1)[1].strip())
-                elif istartswith(line, "NTS:"):
-                    setattr(res, "sub_type", line.split(":", 1)[1].strip())
-                elif istartswith(line, "SERVER:"):
-                    setattr(res, "server", line.split(":", 1)[1].strip())
-                elif istartswith(line, "USN:"):
-                    setattr(res, "usn", line.split(":", 1)[1].strip())
-            return res
-        
-        lines = data.splitlines()
-        if istartswith(lines[0], "M-SEARCH "):
+    def _on_read(self, event, address, data):
+        counters = self._counters
+        counters["received"] += 1
+        if data[:8].upper() == M_SEARCH:
+            # Check limits before spending any effort on the search
+            if not self._search_allowed(address):
+                return
+        elif not self._listened:
+            counters["unlistened_dropped"] += 1
+            return
+        msg = parse_ssdp_message(data)
+        if msg is None:
+            return
+        if msg.method == M_SEARCH:
             # This is a search. It's up to us to repond if we have
             # matching devices
-            search_target = None
-            for line in lines[1:len(lines)-1]:
-                if not line.upper().startswith("ST:"):
-                    continue
-                search_target = line.split(':', 1)[1].strip()
-                f = lambda dev: True
-                # TODO: add criteria
-                if search_target == "upnp:rootdevice":
-                    f = lambda dev: dev.root_device
-                self.fire(upnp_device_query(f, address, search_target), "upnp")                        
+            search_target = msg.search_target
+            if search_target is None:
                 return
-        elif istartswith(lines[0], "NOTIFY "):
+            # Matching devices are looked up by the device server
+            self.fire(upnp_device_search(address, search_target, msg.mx,
+                                         getattr(event, "interface", None)),
+                      "upnp")
+            return
+        if msg.usn is None:
+            return
+        if msg.method == NOTIFY and self._own_devices and self._is_own(msg):
+            counters["own_dropped"] += 1
+            return
+        if not self._is_listened(msg):
+            counters["unlistened_dropped"] += 1
+            return
+        if self._is_duplicate(msg):
+            return
+        if msg.method == NOTIFY:
             # A status change (or confirmation notification. Translate into
             # an event to inform however is interested in this.
-            data = parse_lines(lines[1:])
-            if data.sub_type == "ssdp:alive":
+            sub_type = msg.sub_type
+            if sub_type == "ssdp:alive":
                 self.fire(upnp_device_alive\
-                          (data.location, data.notification_type, 
-                           data.max_age, data.server, data.usn))
-            elif data.sub_type == "ssdp:byebye":
-                self.fire(upnp_device_bye_bye(data.usn))
-        elif istartswith(lines[0], "HTTP/1.1 200 OK"):
+                          (msg.location, msg.notification_type, 
+                           msg.max_age, msg.server, msg.usn))
+            elif sub_type == "ssdp:byebye":
+                self.fire(upnp_device_bye_bye(msg.usn))
+        else:
             # A response to our own M-SEARCH. This is handled like a 
             # status change/confirmation (can only be an alive notification,
             # of course).
-            data = parse_lines(lines[1:])
             self.fire(upnp_device_alive\
-                      (data.location, data.notification_type, 
-                       data.max_age, data.server, data.usn))
+                      (msg.location, msg.notification_type, 
+                       msg.max_age, msg.server, msg.usn))
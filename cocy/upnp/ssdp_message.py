@@ -0,0 +1,144 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+
+M_SEARCH = "M-SEARCH"
+NOTIFY = "NOTIFY"
+RESPONSE = "RESPONSE"
+
+
+class SSDPMessage(object):
+    """
+    A received SSDP message. The message is tokenized once when it is
+    created by :func:`parse_ssdp_message`. Headers are stored with their
+    names converted to upper case, so lookups with :meth:`header` are
+    case-insensitive.
+
+    The ``method`` is one of ``M_SEARCH``, ``NOTIFY`` or ``RESPONSE``
+    (a ``200 OK`` reply to an M-SEARCH).
+    """
+    __slots__ = ("method", "headers")
+
+    def __init__(self, method, headers):
+        self.method = method
+        self.headers = headers
+
+    def header(self, name, default=None):
+        return self.headers.get(name.upper(), default)
+
+    def __contains__(self, name):
+        return name.upper() in self.headers
+
+    @property
+    def location(self):
+        return self.headers.get("LOCATION")
+
+    @property
+    def notification_type(self):
+        """
+        The NT of a notification or the ST of a search response (search
+        responses are handled like alive messages).
+        """
+        headers = self.headers
+        return headers.get("NT") or headers.get("ST")
+
+    @property
+    def sub_type(self):
+        return self.headers.get("NTS")
+
+    @property
+    def search_target(self):
+        return self.headers.get("ST")
+
+    @property
+    def server(self):
+        return self.headers.get("SERVER")
+
+    @property
+    def usn(self):
+        return self.headers.get("USN")
+
+    @property
+    def max_age(self):
+        """
+        The max-age from the CACHE-CONTROL header or ``None`` if the
+        header is missing or invalid.
+        """
+        value = self.headers.get("CACHE-CONTROL")
+        if value is None:
+            return None
+        for directive in value.split(","):
+            name, sep, arg = directive.partition("=")
+            if sep and name.strip().lower() == "max-age":
+                try:
+                    return int(arg.strip().strip('"'))
+                except ValueError:
+                    return None
+        return None
+
+    @property
+    def mx(self):
+        """
+        The MX header of an M-SEARCH or ``None`` if missing or invalid.
+        """
+        try:
+            return int(self.headers["MX"])
+        except (KeyError, ValueError):
+            return None
+
+    @property
+    def boot_id(self):
+        try:
+            return int(self.headers["BOOTID.UPNP.ORG"])
+        except (KeyError, ValueError):
+            return None
+
+    @property
+    def config_id(self):
+        try:
+            return int(self.headers["CONFIGID.UPNP.ORG"])
+        except (KeyError, ValueError):
+            return None
+
+
+def parse_ssdp_message(data):
+    """
+    Parse the given datagram. Returns an :class:`SSDPMessage` or
+    ``None`` if the data is not an SSDP message.
+    """
+    lines = data.splitlines()
+    if not lines:
+        return None
+    start = lines[0].split(" ", 2)
+    method = start[0].upper()
+    if method == M_SEARCH or method == NOTIFY:
+        pass
+    elif method.startswith("HTTP/") and start[1:2] == ["200"]:
+        method = RESPONSE
+    else:
+        return None
+    headers = dict()
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if not sep:
+            # Blank line at end of headers or garbage
+            continue
+        headers[name.strip().upper()] = value.strip()
+    return SSDPMessage(method, headers)
@@ -40,5 +40,8 @@ setup(
                                     'templates/themes/default/*'],
                   'cocy.upnp': ['services/*.xml',
                                 'templates/*']},
+   entry_points = {
+       'console_scripts': ['cocy-ssdp-census = cocy.upnp.census:main'],
+   },
    install_requires = ['circuits == 3.2', 'Tenjin', 'rbtranslations', 'circuits-bricks == 0.4.4'],
 )
\ No newline at end of file
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+
+Benchmark for serving device and service descriptions. *devices*
+local devices are registered with a :class:`cocy.upnp.UPnPDeviceServer`,
+then their descriptions are fetched over loopback by *clients*
+threads using persistent connections. The run is done twice, first
+with the descriptions answered by
+:class:`cocy.core.document.StaticResponses`, then with the store
+removed, i.e. with the descriptions dispatched to the controllers.
+
+The results are written as JSON object.
+
+Usage: ``python description_load.py [options]`` (``--help`` for details)
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import httplib
+import tempfile
+import threading
+from argparse import ArgumentParser
+from circuits.core.manager import Manager
+from circuits.core.events import Event
+from circuits.core.utils import flatten
+from cocy.core.document import StaticResponses
+from cocy.providers import BinarySwitch, Manifest
+from cocy.upnp import UPnPDeviceServer
+import cocy.upnp.adapters
+
+
+class LoadDevice(BinarySwitch):
+
+    def __init__(self, index):
+        super(LoadDevice, self).__init__\
+            (Manifest("description-load-%d" % index, 
+                      "Load device %d" % index))
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def fetch(port, paths, requests, headers, results):
+    connection = httplib.HTTPConnection("127.0.0.1", port)
+    failed = 0
+    for index in range(requests):
+        connection.request("GET", paths[index % len(paths)], 
+                           headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if response.status not in (200, 304):
+            failed += 1
+        if response.getheader("Connection", "").lower() == "close":
+            connection.close()
+            connection = httplib.HTTPConnection("127.0.0.1", port)
+    connection.close()
+    results.append(failed)
+
+
+def run(port, paths, clients, requests, headers):
+    """
+    Let *clients* threads fetch *requests* documents each.
+    """
+    results = []
+    threads = [threading.Thread(target=fetch, args=(port, paths, requests,
+                                                    headers, results))
+               for _ in range(clients)]
+    start_cpu = cpu_time()
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+    cpu_seconds = cpu_time() - start_cpu
+    total = clients * requests
+    return { "requests": total,
+             "failed": sum(results),
+             "seconds": seconds,
+             "cpu_seconds": cpu_seconds,
+             "requests_per_second": total / seconds if seconds else None,
+             "cpu_us_per_request": cpu_seconds * 1e6 / total }
+
+
+def run_variants(port, paths, args):
+    results = dict()
+    for name, headers in [("plain", {}),
+                          ("gzip", { "Accept-Encoding": "gzip" })]:
+        # Let every document be generated (and compressed) once
+        fetch(port, paths, len(paths), headers, [])
+        results[name] = run(port, paths, args.clients, args.requests, headers)
+    return results
+
+
+def main():
+    parser = ArgumentParser(description="Description serving benchmark.")
+    parser.add_argument("--devices", type=int, default=20,
+                        help="local devices (default: 20)")
+    parser.add_argument("--clients", type=int, default=4,
+                        help="concurrent clients (default: 4)")
+    parser.add_argument("--requests", type=int, default=500,
+                        help="requests per client (default: 500)")
+    parser.add_argument("--output", metavar="FILE",
+                        help="write the results to FILE instead of stdout")
+    args = parser.parse_args()
+
+    app_dir = tempfile.mkdtemp()
+    manager = Manager()
+    server = UPnPDeviceServer(app_dir).register(manager)
+    server.add_providers([LoadDevice(index) 
+                          for index in range(args.devices)])
+    manager.start()
+    manager.fire(Event.create("started", manager), "application")
+    # Let the initial announcements pass
+    time.sleep(1 + args.devices / 200.0)
+
+    paths = []
+    for device in server._devices:
+        paths.append(device.path + "/description.xml")
+        paths.extend([service.description_url 
+                      for service in device.services])
+    paths = sorted(set(paths))
+    results = { "config": vars(args), "documents": len(paths) }
+    try:
+        results["static"] = run_variants(server.web_server.port, paths, args)
+        for store in [c for c in flatten(manager) 
+                      if isinstance(c, StaticResponses)]:
+            store.unregister()
+        time.sleep(0.5)
+        results["dispatched"] = run_variants(server.web_server.port,
+                                             paths, args)
+    finally:
+        manager.stop()
+        shutil.rmtree(app_dir, ignore_errors=True)
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    json.dump(results, out, indent=2, sort_keys=True)
+    out.write("\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+
+Micro-benchmark for the parser of UPnP action requests. A typical
+action request is parsed repeatedly, once with
+:func:`cocy.misc.parseSoapAction` and once with the soaplib based
+:func:`cocy.misc.parseSoapRequest` previously used by the control
+endpoint.
+
+Usage: ``python soap_action.py [rounds]``
+"""
+import sys
+import timeit
+from io import BytesIO
+from cocy.misc import parseSoapAction, parseSoapRequest, splitQTag
+
+BODY = '<?xml version="1.0" encoding="utf-8"?>' \
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"' \
+    ' s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">' \
+    '<s:Body><u:SetTarget' \
+    ' xmlns:u="urn:schemas-upnp-org:service:SwitchPower:1">' \
+    '<newTargetValue>1</newTargetValue></u:SetTarget></s:Body></s:Envelope>'
+
+
+class Request(object):
+
+    def __init__(self):
+        self.headers = { "SOAPAction": '"urn:schemas-upnp-org:service:'
+                         'SwitchPower:1#SetTarget"',
+                         "Content-Type": 'text/xml; charset="utf-8"' }
+        self.body = BytesIO(BODY)
+
+
+def legacy_parse(request):
+    payload = parseSoapRequest(request)[2]
+    action_ns, action = splitQTag(payload.tag)
+    action_args = dict()
+    for node in payload:
+        action_args[node.tag] = node.text
+    return action_ns, action, action_args
+
+
+def run(parser, rounds):
+    def parse():
+        parser(Request())
+    return min(timeit.repeat(parse, number=rounds, repeat=3))
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    assert legacy_parse(Request()) == parseSoapAction(Request())
+    for name, parser in [("parseSoapRequest", legacy_parse),
+                         ("parseSoapAction", parseSoapAction)]:
+        secs = run(parser, rounds)
+        print ("%-20s %8.0f requests/s  %6.2f us/request"
+               % (name, rounds / secs, secs * 1e6 / rounds))
+
+
+if __name__ == '__main__':
+    main()
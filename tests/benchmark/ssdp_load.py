@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+
+Load generator for the SSDP discovery path. The benchmark has two
+phases:
+
+replay
+    Recorded datagrams (a file in the format of ``ssdp_datagrams.txt``)
+    or the notifications of synthesized remote devices are fed into
+    :class:`cocy.upnp.ssdp.SSDPReceiver` as ``read`` events. The
+    events are dispatched without running the manager's main loop,
+    so the CPU time reported is the time spent in the handlers.
+    The datagrams are replayed twice: without listeners (reported as
+    ``replay_unlistened``, the receiver drops them early) and after
+    registering ``ssdp:all`` with ``ssdp_listen`` (reported as
+    ``replay``, the datagrams are parsed and passed on as events).
+
+search
+    *devices* local devices are registered with a
+    :class:`cocy.upnp.UPnPDeviceServer`, *control-points* UDP sockets
+    on the loopback interface act as searching control points. Their
+    M-SEARCH requests are fed into the receiver, the responses
+    are sent by :class:`cocy.upnp.ssdp.SSDPSender` and received
+    over loopback. The latency is measured from firing the request
+    to receiving a response. The CPU time reported is the CPU time
+    of the process during this phase.
+
+The results are written as JSON object.
+
+Usage: ``python ssdp_load.py [options]`` (``--help`` for details)
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import select
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from circuits.core.manager import Manager
+from circuits.core.events import Event
+from circuits.core.utils import flatten
+from circuits.net.sockets import read
+from circuits_bricks.app.config import config_value
+from cocy.providers import BinarySwitch, Manifest
+from cocy.upnp import UPnPDeviceServer
+from cocy.upnp.ssdp import SSDPReceiver, ssdp_listen
+import cocy.upnp.adapters
+from ssdp_parser import load_datagrams
+
+
+class LoadDevice(BinarySwitch):
+
+    def __init__(self, index):
+        super(LoadDevice, self).__init__\
+            (Manifest("ssdp-load-%d" % index, "Load device %d" % index))
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    def pick(fraction):
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+    return { "min": values[0], "p50": pick(0.5), "p95": pick(0.95),
+             "p99": pick(0.99), "max": values[-1] }
+
+
+def synthesize_notifications(remote_devices):
+    datagrams = []
+    for index in range(remote_devices):
+        uuid = "uuid:00000000-0000-0000-0000-%012d" % index
+        for nt, usn in [("upnp:rootdevice", uuid + "::upnp:rootdevice"),
+                        (uuid, uuid),
+                        ("urn:schemas-upnp-org:device:BinaryLight:1",
+                         uuid + "::urn:schemas-upnp-org:device:BinaryLight:1")]:
+            source = ("10.%d.%d.%d" % (index >> 16 & 255, index >> 8 & 255,
+                                       index & 255), 1900)
+            datagrams.append((source, "NOTIFY * HTTP/1.1\r\n"
+                              "HOST: 239.255.255.250:1900\r\n"
+                              "CACHE-CONTROL: max-age=1800\r\n"
+                              "LOCATION: http://%s:1024/desc.xml\r\n"
+                              "NT: %s\r\n"
+                              "NTS: ssdp:alive\r\n"
+                              "SERVER: Linux/3.2 UPnP/1.1 Load/1.0\r\n"
+                              "USN: %s\r\n"
+                              "BOOTID.UPNP.ORG: 1\r\n"
+                              "\r\n" % (source[0], nt, usn)))
+    return datagrams
+
+
+def drain(manager):
+    while len(manager) > 0:
+        manager.flush()
+
+
+def replay(manager, receiver, datagrams, rounds):
+    """
+    Feed the datagrams into the receiver *rounds* times.
+    """
+    before = receiver.counters
+    for _ in range(rounds):
+        for address, data in datagrams:
+            manager.fire(read(address, data), "ssdp")
+    total = len(datagrams) * rounds
+    start_cpu = cpu_time()
+    start = time.time()
+    drain(manager)
+    seconds = time.time() - start
+    cpu_seconds = cpu_time() - start_cpu
+    counters = receiver.counters
+    return { "datagrams": total,
+             "seconds": seconds,
+             "cpu_seconds": cpu_seconds,
+             "datagrams_per_second": total / seconds if seconds else None,
+             "cpu_us_per_datagram": cpu_seconds * 1e6 / total,
+             "counters": dict([(key, counters[key] - before.get(key, 0))
+                               for key in counters]) }
+
+
+def search(manager, control_points, search_target, mx, rounds,
+           expected, timeout):
+    """
+    Let every control point search *rounds* times and collect the
+    responses.
+    """
+    sockets = []
+    for _ in range(control_points):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.setblocking(0)
+        sockets.append(sock)
+    request = "M-SEARCH * HTTP/1.1\r\n" \
+        "HOST: 239.255.255.250:1900\r\n" \
+        "MAN: \"ssdp:discover\"\r\n" \
+        "MX: %d\r\n" \
+        "ST: %s\r\n\r\n" % (mx, search_target)
+    latencies = []
+    first_latencies = []
+    received = 0
+    start_cpu = cpu_time()
+    start = time.time()
+    for _ in range(rounds):
+        sent = dict()
+        for sock in sockets:
+            sent[sock] = time.time()
+            manager.fire(read(sock.getsockname(), request), "ssdp")
+        pending = dict([(sock, expected) for sock in sockets])
+        deadline = time.time() + mx + timeout
+        while pending and time.time() < deadline:
+            ready = select.select(pending.keys(), [], [],
+                                  max(0, deadline - time.time()))[0]
+            now = time.time()
+            for sock in ready:
+                while True:
+                    try:
+                        sock.recv(4096)
+                    except socket.error:
+                        break
+                    received += 1
+                    latency = (now - sent[sock]) * 1000
+                    if pending[sock] == expected:
+                        first_latencies.append(latency)
+                    latencies.append(latency)
+                    pending[sock] -= 1
+                    if pending[sock] == 0:
+                        del pending[sock]
+                        break
+    seconds = time.time() - start
+    cpu_seconds = cpu_time() - start_cpu
+    for sock in sockets:
+        sock.close()
+    return { "searches": control_points * rounds,
+             "responses_expected": control_points * rounds * expected,
+             "responses": received,
+             "seconds": seconds,
+             "cpu_seconds": cpu_seconds,
+             "responses_per_second": received / seconds if seconds else None,
+             "latency_ms": percentiles(latencies),
+             "first_response_latency_ms": percentiles(first_latencies) }
+
+
+def main():
+    parser = ArgumentParser(description="SSDP replay and load benchmark.")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="datagrams to replay instead of synthesized "
+                        "notifications")
+    parser.add_argument("--remote-devices", type=int, default=1000,
+                        help="synthesized remote devices (default: 1000)")
+    parser.add_argument("--replay-rounds", type=int, default=10,
+                        help="times the datagrams are replayed (default: 10)")
+    parser.add_argument("--devices", type=int, default=20,
+                        help="local devices (default: 20)")
+    parser.add_argument("--control-points", type=int, default=20,
+                        help="searching control points (default: 20)")
+    parser.add_argument("--search-rounds", type=int, default=5,
+                        help="searches per control point (default: 5)")
+    parser.add_argument("--mx", type=int, default=1,
+                        help="MX of the searches (default: 1)")
+    parser.add_argument("--output", metavar="FILE",
+                        help="write the results to FILE instead of stdout")
+    args = parser.parse_args()
+
+    app_dir = tempfile.mkdtemp()
+    manager = Manager()
+    UPnPDeviceServer(app_dir).register(manager)
+    receiver = [c for c in flatten(manager) if isinstance(c, SSDPReceiver)][0]
+    for index in range(args.devices):
+        LoadDevice(index).register(manager)
+    # The benchmark is about throughput, not about protection
+    for option, value in [("ssdp-source-search-rate", "1000000"),
+                          ("ssdp-search-rate", "1000000"),
+                          ("search-response-rate", "1000000")]:
+        manager.fire(config_value("upnp", option, value))
+    drain(manager)
+
+    results = { "config": vars(args) }
+    if args.replay:
+        datagrams = [(("10.0.0.1", 1900), data)
+                     for data in load_datagrams(args.replay)]
+    else:
+        datagrams = synthesize_notifications(args.remote_devices)
+    results["replay_unlistened"] = replay(manager, receiver, datagrams,
+                                          args.replay_rounds)
+    manager.fire(ssdp_listen(["ssdp:all"]))
+    drain(manager)
+    results["replay"] = replay(manager, receiver, datagrams,
+                               args.replay_rounds)
+
+    manager.start()
+    manager.fire(Event.create("started", manager), "application")
+    # Let the initial announcements pass
+    time.sleep(1)
+    try:
+        results["search"] = search(manager, args.control_points,
+                                   "upnp:rootdevice", args.mx,
+                                   args.search_rounds, args.devices, 2)
+    finally:
+        manager.stop()
+        shutil.rmtree(app_dir, ignore_errors=True)
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    json.dump(results, out, indent=2, sort_keys=True)
+    out.write("\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+
+Micro-benchmark for the SSDP message parser. The datagrams in
+``ssdp_datagrams.txt`` are parsed repeatedly, once with
+:func:`cocy.upnp.ssdp_message.parse_ssdp_message` and once with the
+line-by-line ``istartswith`` approach previously used by the receiver.
+
+Usage: ``python ssdp_parser.py [rounds]``
+"""
+
+import os
+import sys
+import timeit
+from cocy.upnp.ssdp_message import parse_ssdp_message
+
+DATAGRAMS_FILE = os.path.join(os.path.dirname(__file__), "ssdp_datagrams.txt")
+
+
+def load_datagrams(path=DATAGRAMS_FILE):
+    datagrams = []
+    for block in open(path).read().split("----\n"):
+        lines = block.strip("\n").split("\n")
+        datagrams.append("\r\n".join(lines) + "\r\n\r\n")
+    return datagrams
+
+
+def legacy_parse(data):
+    """
+    The parser formerly built into ``SSDPReceiver._on_read``, kept
+    here as a reference.
+    """
+    def istartswith(line, prefix):
+        return line[0:len(prefix)].upper() == prefix
+
+    lines = data.splitlines()
+    res = type("", (), {})()
+    if istartswith(lines[0], "M-SEARCH "):
+        for line in lines[1:len(lines)-1]:
+            if line.upper().startswith("ST:"):
+                setattr(res, "search_target", line.split(':', 1)[1].strip())
+        return res
+    for line in lines[1:]:
+        if istartswith(line, "CACHE-CONTROL:"):
+            s = line.split(":", 1)[1].strip()
+            setattr(res, "max_age", int(s.split("=", 1)[1].strip()))
+        elif istartswith(line, "LOCATION:"):
+            setattr(res, "location", line.split(":", 1)[1].strip())
+        elif istartswith(line, "NT:"):
+            setattr(res, "notification_type", line.split(":", 1)[1].strip())
+        elif istartswith(line, "ST:"):
+            setattr(res, "notification_type", line.split(":", 1)[1].strip())
+        elif istartswith(line, "NTS:"):
+            setattr(res, "sub_type", line.split(":", 1)[1].strip())
+        elif istartswith(line, "SERVER:"):
+            setattr(res, "server", line.split(":", 1)[1].strip())
+        elif istartswith(line, "USN:"):
+            setattr(res, "usn", line.split(":", 1)[1].strip())
+    return res
+
+
+def current_parse(data):
+    msg = parse_ssdp_message(data)
+    # Access the attributes used by the receiver
+    msg.usn, msg.sub_type, msg.location, msg.notification_type, msg.max_age
+    return msg
+
+
+def run(parser, datagrams, rounds):
+    def parse_all():
+        for data in datagrams:
+            parser(data)
+    return min(timeit.repeat(parse_all, number=rounds, repeat=3))
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    datagrams = load_datagrams()
+    total = rounds * len(datagrams)
+    for name, parser in [("legacy", legacy_parse),
+                         ("parse_ssdp_message", current_parse)]:
+        secs = run(parser, datagrams, rounds)
+        print ("%-20s %8.0f datagrams/s  %6.2f us/datagram"
+               % (name, total / secs, secs * 1e6 / total))
+
+
+if __name__ == '__main__':
+    main()
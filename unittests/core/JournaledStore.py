@@ -0,0 +1,69 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from cocy.core.store import JournaledStore
+
+class TestJournaledStore(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_persistence(self):
+        store = JournaledStore(self.path, batch_size=2)
+        self.assertEqual(store.setdefault("a", "1"), "1")
+        self.assertEqual(store.setdefault("a", "2"), "1")
+        self.assertEqual(store.pending, 1)
+        store.setdefault("b", "2")
+        self.assertEqual(store.pending, 0)
+        store.setdefault("c", "3")
+        store.close()
+        store = JournaledStore(self.path)
+        self.assertEqual([store["a"], store["b"], store["c"]], ["1", "2", "3"])
+        self.assertEqual(store.errors, 0)
+
+    def test_shared(self):
+        first = JournaledStore(self.path)
+        second = JournaledStore(self.path)
+        first.setdefault("a", "1")
+        first.flush()
+        self.assertEqual(second.setdefault("a", "2"), "1")
+
+    def test_torn_line(self):
+        store = JournaledStore(self.path)
+        store.setdefault("a", "1")
+        store.close()
+        with open(self.path, "a") as journal:
+            journal.write('["b", "')
+        store = JournaledStore(self.path)
+        self.assertFalse("b" in store)
+        store.setdefault("c", "3")
+        store.close()
+        store = JournaledStore(self.path)
+        self.assertEqual(store.errors, 1)
+        self.assertEqual(store.get("a"), "1")
+        self.assertEqual(store.get("c"), "3")
@@ -0,0 +1,51 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from unittest import TestCase
+from cocy.core.router import PathTrie
+
+
+class TestPathTrie(TestCase):
+
+    def test_prefixes(self):
+        trie = PathTrie()
+        trie.add("/", "root")
+        trie.add("/uuid-1", "device")
+        trie.add("/uuid-1/SwitchPower", "service")
+        self.assertEqual(len(trie), 3)
+        self.assertEqual(trie.prefixes(["uuid-1", "SwitchPower", "control"]),
+                         [("service", ["control"]),
+                          ("device", ["SwitchPower", "control"]),
+                          ("root", ["uuid-1", "SwitchPower", "control"])])
+        self.assertEqual(trie.prefixes(["other"]), [("root", ["other"])])
+        self.assertEqual(trie.get("/uuid-1/"), "device")
+
+    def test_remove(self):
+        trie = PathTrie()
+        trie.add("/a/b/c", 1)
+        trie.add("/a", 2)
+        trie.remove("/a/b/c", 3)
+        self.assertEqual(trie.get("/a/b/c"), 1)
+        trie.remove("/a/b/c", 1)
+        self.assertEqual(trie.get("/a/b/c"), None)
+        self.assertEqual(trie._root[1]["a"][1], {})
+        trie.remove("/a")
+        self.assertEqual(len(trie), 0)
+        self.assertEqual(trie._root[1], {})
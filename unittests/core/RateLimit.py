@@ -0,0 +1,45 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from unittest import TestCase
+from unittest import TestCase
+from cocy.core.ratelimit import TokenBucket, TokenBucketMap
+
+class TestRateLimit(TestCase):
+
+    def test_bucket(self):
+        bucket = TokenBucket(2, 4, now=0)
+        for i in range(4):
+            self.assertTrue(bucket.consume(now=0))
+        self.assertFalse(bucket.consume(now=0))
+        self.assertFalse(bucket.consume(now=0.25))
+        self.assertTrue(bucket.consume(now=0.5))
+        self.assertTrue(bucket.consume(2, now=100))
+        self.assertFalse(bucket.consume(3, now=100))
+
+    def test_map(self):
+        buckets = TokenBucketMap(1, 1, max_keys=2)
+        self.assertTrue(buckets.consume("a", now=0))
+        self.assertFalse(buckets.consume("a", now=0))
+        self.assertTrue(buckets.consume("b", now=0))
+        self.assertTrue(buckets.consume("c", now=0))
+        self.assertEqual(len(buckets), 2)
+        # "a" has been discarded and starts with a full bucket
+        self.assertTrue(buckets.consume("a", now=0))
@@ -0,0 +1,137 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+import gzip
+from StringIO import StringIO
+from unittest import TestCase
+from cocy.core.clock import http_date
+from cocy.core import document
+from cocy.core.document import StaticDocument, EncodedHeaders
+
+DATE = "Thu, 01 Jan 2026 00:00:00 GMT"
+
+
+class Message(object):
+
+    def __init__(self, headers=None):
+        self.headers = dict(headers or {})
+        self.status = 200
+
+
+class TestStaticDocument(TestCase):
+
+    def setUp(self):
+        self.doc = StaticDocument("<root>" + "x" * 1000 + "</root>",
+                                  "text/xml", 3, last_modified=1000000)
+
+    def serve(self, **headers):
+        response = Message()
+        body = self.doc.serve(Message(headers), response)
+        return response, body
+
+    def test_plain(self):
+        response, body = self.serve()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, self.doc.body)
+        self.assertTrue(response.headers["ETag"].startswith('"3-'))
+        self.assertFalse("Content-Encoding" in response.headers)
+
+    def test_gzip(self):
+        response, body = self.serve(**{ "Accept-Encoding": "deflate, gzip" })
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(body)).read(),
+                         self.doc.body)
+        self.assertNotEqual(response.headers["ETag"], self.doc.etag)
+        response, body = self.serve(**{ "Accept-Encoding": "gzip;q=0" })
+        self.assertEqual(body, self.doc.body)
+
+    def test_conditional(self):
+        response, body = self.serve(**{ "If-None-Match": self.doc.etag })
+        self.assertTrue(body is response)
+        self.assertEqual((response.status, response.body), (304, ""))
+        encoded = str(response.headers)
+        self.assertFalse("Content-Length" in encoded)
+        self.assertFalse("Content-Type" in encoded)
+        self.assertTrue("ETag: %s\r\n" % self.doc.etag in encoded)
+        response, body = self.serve(**{ "If-None-Match": '"other"' })
+        self.assertEqual(response.status, 200)
+        response, body = self.serve\
+            (**{ "If-Modified-Since": http_date(1000000) })
+        self.assertEqual(response.status, 304)
+        response, body = self.serve\
+            (**{ "If-Modified-Since": http_date(999999) })
+        self.assertEqual(response.status, 200)
+
+    def test_respond(self):
+        request = Message({ "Accept-Encoding": "gzip" })
+        response = Message({ "Server": "test" })
+        self.doc.respond(request, response)
+        self.assertEqual(response.status, 200)
+        encoded = str(response.headers)
+        self.assertTrue("Content-Encoding: gzip\r\n" in encoded)
+        self.assertTrue("Content-Length: %d\r\n" % len(self.doc.gzipped)
+                        in encoded)
+        self.assertTrue("Server: test\r\n" in encoded)
+        self.assertTrue(encoded.endswith("\r\n\r\n"))
+        request.headers["If-None-Match"] = response.headers._encoded \
+            .split("ETag: ")[1].split("\r\n")[0]
+        response = Message()
+        self.doc.respond(request, response)
+        self.assertEqual(response.status, 304)
+        self.assertFalse("Content-Length" in str(response.headers))
+        self.assertFalse("Content-Type" in str(response.headers))
+
+    def test_date(self):
+        document.http_date = lambda: DATE
+        try:
+            response, body = self.serve()
+            self.assertEqual(response.headers["Date"], DATE)
+            response = Message()
+            self.doc.respond(Message(), response)
+            self.assertTrue("Date: %s\r\n" % DATE in str(response.headers))
+        finally:
+            document.http_date = http_date
+
+
+class TestEncodedHeaders(TestCase):
+
+    def setUp(self):
+        document.http_date = lambda: DATE
+
+    def tearDown(self):
+        document.http_date = http_date
+
+    def test_merged(self):
+        headers = EncodedHeaders("Server: test\r\nContent-Length: 0\r\n",
+                                 ("Content-Type",))
+        headers["Date"] = "Mon, 01 Jan 2001 00:00:00 GMT"
+        headers["server"] = "other"
+        headers["Content-Length"] = "10"
+        headers["Content-Type"] = "text/html"
+        headers["Connection"] = "close"
+        headers["SID"] = "uuid:1"
+        encoded = str(headers)
+        self.assertTrue(encoded.startswith("Server: test\r\nContent-Length: 0"
+                                           "\r\nDate: %s\r\n" % DATE))
+        self.assertTrue(encoded.endswith("\r\n\r\n"))
+        lines = encoded.split("\r\n")[:-2]
+        self.assertEqual(len(lines), 5)
+        self.assertTrue("Connection: close" in lines)
+        self.assertTrue("Sid: uuid:1" in lines)
@@ -0,0 +1,105 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from unittest import TestCase
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from circuits.core.manager import Manager
+from circuits.web.events import request
+from cocy.core.document import StaticDocument, StaticResponses
+
+
+class Message(object):
+
+    def __init__(self, method="GET", path="/", headers=None):
+        self.method = method
+        self.path = path
+        self.headers = dict(headers or {})
+        self.status = 200
+        self.body = None
+
+
+class Documents(BaseComponent):
+
+    channel = "documents"
+
+    def __init__(self, documents):
+        super(Documents, self).__init__()
+        self.static_documents = dict([(path, (lambda doc: lambda: doc)(doc))
+                                      for path, doc in documents.items()])
+
+
+class Dispatcher(BaseComponent):
+
+    channel = "web"
+
+    def __init__(self):
+        super(Dispatcher, self).__init__()
+        self.dispatched = []
+
+    @handler("request", priority=0.1)
+    def _on_request(self, request, response, peer_cert=None):
+        self.dispatched.append((request.method, request.path))
+
+
+class TestStaticResponses(TestCase):
+
+    def setUp(self):
+        self.manager = Manager()
+        self.store = StaticResponses().register(self.manager)
+        self.dispatcher = Dispatcher().register(self.manager)
+        self.doc = StaticDocument("<root/>", "text/xml", 1)
+        self.container = BaseComponent(channel="container") \
+            .register(self.manager)
+        Documents({ "/static.xml": self.doc }).register(self.container)
+        self.drain()
+
+    def drain(self):
+        while len(self.manager) > 0:
+            self.manager.flush()
+
+    def request(self, method, path):
+        response = Message(headers={ "Server": "test" })
+        self.manager.fire(request(Message(method, path), response), "web")
+        self.drain()
+        return response
+
+    def test_intercepted(self):
+        self.assertEqual(len(self.store), 1)
+        response = self.request("GET", "/static.xml")
+        self.assertEqual(response.body, self.doc.body)
+        self.assertTrue("Server: test\r\n" in str(response.headers))
+        self.assertEqual(self.dispatcher.dispatched, [])
+
+    def test_dispatched(self):
+        self.request("GET", "/other.xml")
+        self.request("POST", "/static.xml")
+        self.assertEqual(self.dispatcher.dispatched,
+                         [("GET", "/other.xml"), ("POST", "/static.xml")])
+
+    def test_unregister(self):
+        # Removing an ancestor removes the documents
+        self.container.unregister()
+        self.drain()
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(self.store._provider_paths, {})
+        response = self.request("GET", "/static.xml")
+        self.assertEqual(response.body, None)
+        self.assertEqual(self.dispatcher.dispatched, [("GET", "/static.xml")])
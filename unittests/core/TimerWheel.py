@@ -0,0 +1,67 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from unittest import TestCase
+from random import Random
+from cocy.core.timerwheel import TimerWheel
+
+class TestTimerWheel(TestCase):
+
+    def test_expiry(self):
+        wheel = TimerWheel(resolution=1, slots=4, levels=3, now=0)
+        wheel.schedule("a", 2, "A")
+        wheel.schedule("b", 30, "B")
+        wheel.schedule("c", 500, "C")
+        self.assertEqual(len(wheel), 3)
+        self.assertEqual(wheel.advance(1), [])
+        self.assertEqual(wheel.advance(2), [("a", "A")])
+        self.assertEqual(wheel.advance(29), [])
+        self.assertEqual(wheel.advance(30), [("b", "B")])
+        self.assertEqual(wheel.advance(499), [])
+        self.assertEqual(wheel.advance(500), [("c", "C")])
+        self.assertEqual(len(wheel), 0)
+
+    def test_cancel_and_replace(self):
+        wheel = TimerWheel(resolution=1, slots=4, levels=2, now=0)
+        wheel.schedule("a", 5, "A")
+        wheel.schedule("b", 5, "B")
+        self.assertEqual(wheel.cancel("a"), "A")
+        self.assertEqual(wheel.cancel("a"), None)
+        wheel.schedule("b", 9, "B2")
+        self.assertEqual(wheel.advance(8), [])
+        self.assertEqual(wheel.advance(9), [("b", "B2")])
+
+    def test_random(self):
+        rnd = Random(4711)
+        wheel = TimerWheel(resolution=1, slots=8, levels=3, now=0)
+        expected = dict()
+        now = 0
+        for step in range(2000):
+            for i in range(rnd.randint(0, 3)):
+                key = rnd.randint(0, 200)
+                delay = rnd.randint(1, 1000)
+                wheel.schedule(key, delay, now + delay)
+                expected[key] = now + delay
+            now += rnd.randint(0, 5)
+            for key, due in wheel.advance(now):
+                self.assertEqual(expected.pop(key), due)
+                self.assertTrue(due <= now)
+            for key, due in expected.items():
+                self.assertTrue(due > now)
@@ -0,0 +1,94 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from unittest import TestCase
+from circuits.core.manager import Manager
+from circuits.core.events import Event
+from circuits.core.utils import flatten
+from circuits_bricks.app.config import config_value
+from circuits_bricks.core.timers import TimerSchedule
+from cocy.upnp import UPNP_ROOTDEVICE
+from cocy.upnp.device_directory import UPnPDeviceDirectory
+from cocy.upnp.ssdp import SSDPReceiver, upnp_device_alive, \
+    upnp_device_bye_bye
+
+DEVICE_TYPE = "urn:schemas-upnp-org:device:BinaryLight:1"
+UUID = "uuid:00000000-0000-0000-0000-000000000001"
+LOCATION = "http://127.0.0.1:9/desc.xml"
+
+
+class TestDeviceDirectory(TestCase):
+
+    def setUp(self):
+        self.manager = Manager()
+        self.directory = UPnPDeviceDirectory().register(self.manager)
+        self.manager.fire(config_value("upnp", "search-targets", 
+                                       UPNP_ROOTDEVICE + "," + DEVICE_TYPE))
+        self.drain()
+        self.timers = len(TimerSchedule._timers)
+
+    def tearDown(self):
+        for timer in list(TimerSchedule._timers):
+            if timer.root is self.manager:
+                timer.unregister()
+
+    def drain(self):
+        while len(self.manager) > 0:
+            self.manager.flush()
+
+    def alive(self, nt, max_age=1800):
+        self.manager.fire(upnp_device_alive(LOCATION, nt, max_age, "Test",
+                                            UUID + "::" + nt))
+        self.drain()
+
+    def test_listen(self):
+        receiver = [c for c in flatten(self.manager)
+                    if isinstance(c, SSDPReceiver)][0]
+        self.assertEqual(receiver._listened, { UPNP_ROOTDEVICE: 1,
+                                               DEVICE_TYPE: 1 })
+        self.manager.fire(config_value("upnp", "search-targets", 
+                                       DEVICE_TYPE))
+        self.drain()
+        self.assertEqual(receiver._listened, { DEVICE_TYPE: 1 })
+
+    def test_dedup(self):
+        self.alive(UPNP_ROOTDEVICE)
+        self.alive(DEVICE_TYPE)
+        self.assertEqual(len(self.directory._devices), 1)
+        self.manager.fire(upnp_device_bye_bye(UUID + "::" + DEVICE_TYPE))
+        self.drain()
+        self.assertEqual(self.directory._devices, {})
+        self.assertEqual(len(TimerSchedule._timers), self.timers)
+
+    def test_error(self):
+        self.alive(UPNP_ROOTDEVICE)
+        device = self.directory._devices.values()[0]
+        self.manager.fire(Event.create("error", None), device._comm_chan)
+        self.drain()
+        self.assertEqual(self.directory._devices, {})
+        self.assertEqual(len(TimerSchedule._timers), self.timers)
+
+    def test_no_max_age(self):
+        self.alive(UPNP_ROOTDEVICE, None)
+        device = self.directory._devices.values()[0]
+        self.assertEqual(device._expiry_timer.interval, 1800)
+        device.refresh(60)
+        self.alive(UPNP_ROOTDEVICE, None)
+        self.assertEqual(device._expiry_timer.interval, 1800)
@@ -0,0 +1,343 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+import gc
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import httplib
+import urllib2
+from xml.etree import ElementTree
+from unittest import TestCase
+from circuits.core.manager import Manager
+from circuits.core.events import Event
+from circuits.core.handlers import handler
+from circuits.core.utils import flatten
+from circuits_bricks.core.timers import TimerSchedule
+from cocy.providers import BinarySwitch, Manifest, Icon
+from cocy.upnp import UPnPDeviceServer, SSDP_DEVICE_SCHEMA
+from cocy.upnp.ssdp import SSDPSender, SSDPReceiver
+from cocy.upnp.adapters.adapter import UPnPServiceController
+from cocy.core.document import StaticResponses
+import cocy.upnp.adapters
+import cocy.portlets
+
+DEFAULT_ICON = os.path.join(os.path.dirname(cocy.portlets.__file__),
+                            "templates", "themes", "default",
+                            "default-device.png")
+
+
+class TestDeviceServer(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.manager = Manager()
+        self.server = UPnPDeviceServer(self.path).register(self.manager)
+        self.manager.fire(Event.create("started", self.manager),
+                          "application")
+        self.drain()
+
+    def tearDown(self):
+        self.server._uuid_db.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def drain(self):
+        while len(self.manager) > 0:
+            self.manager.flush()
+
+    def cycle(self):
+        provider = BinarySwitch(Manifest("soak-switch", "Soak Switch")) \
+            .register(self.manager)
+        self.drain()
+        provider.unregister()
+        self.drain()
+
+    def test_teardown(self):
+        provider = BinarySwitch(Manifest("soak-switch", "Soak Switch")) \
+            .register(self.manager)
+        self.drain()
+        self.assertEqual(len(self.server._devices), 1)
+        uuid = self.server._devices[0].uuid
+        provider.unregister()
+        self.drain()
+        self.assertEqual(self.server._devices, [])
+        self.assertEqual(self.server._search_index, {})
+        sender = [c for c in flatten(self.manager)
+                  if isinstance(c, SSDPSender)][0]
+        receiver = [c for c in flatten(self.manager)
+                    if isinstance(c, SSDPReceiver)][0]
+        self.assertFalse(any([key[0] == uuid for key in sender._datagrams]))
+        # Own byebye messages are recognized until they have been looped back
+        self.assertEqual(list(sender._announcements._entries),
+                         [(uuid, "forget")])
+        self.assertTrue(uuid in receiver._own_devices)
+        sender._announcements._start -= 10
+        sender._on_announcement_tick()
+        self.drain()
+        self.assertEqual(len(sender._announcements), 0)
+        self.assertFalse(uuid in receiver._own_devices)
+
+    def test_byebye(self):
+        sent = []
+        @handler("ssdp_write_batch", channel="ssdp")
+        def _on_write_batch(self, datagrams, interface=None):
+            sent.extend([data for address, data in datagrams])
+        self.server.addHandler(_on_write_batch)
+        sender = [c for c in flatten(self.manager)
+                  if isinstance(c, SSDPSender)][0]
+        sender.interfaces = { "test": "127.0.0.1" }
+        provider = BinarySwitch(Manifest("bye-switch", "Bye Switch")) \
+            .register(self.manager)
+        self.drain()
+        device = self.server._devices[0]
+        sender._boot_ids[device.uuid] = 7
+        del sent[:]
+        provider.unregister()
+        self.drain()
+        self.assertTrue(all(["NTS: ssdp:byebye" in data for data in sent]))
+        self.assertTrue(all(["BOOTID.UPNP.ORG: 7\r" in data for data in sent]))
+        # The services are still known when the byebye messages are sent
+        self.assertEqual(len(sent), 4)
+        self.assertTrue(any([":service:SwitchPower:1" in data 
+                             for data in sent]))
+        self.assertEqual(device.services, set())
+        self.assertEqual(sender._boot_ids[device.uuid], 7)
+
+    def test_search(self):
+        matched = []
+        @handler("upnp_device_match", channel="ssdp")
+        def _on_device_match(self, device, inquirer, search_target, 
+                             mx=None, interface=None):
+            matched.append(search_target)
+        self.server.addHandler(_on_device_match)
+        BinarySwitch(Manifest("search-switch", "Search Switch")) \
+            .register(self.manager)
+        self.drain()
+        service = "urn:schemas-upnp-org:service:SwitchPower"
+        # The sender checks the version (see SSDPDeviceDatagrams)
+        for search_target in (service + ":1", service + ":2",
+                              service + "Other:1"):
+            self.server._on_device_search(None, search_target)
+        self.drain()
+        self.assertEqual(matched, [service + ":1", service + ":2"])
+
+    def test_config_ids(self):
+        updated = []
+        @handler("device_updated", channel="upnp")
+        def _on_device_updated(self, device):
+            updated.append(device)
+        self.server.addHandler(_on_device_updated)
+        first = BinarySwitch(Manifest("first-switch", "First Switch")) \
+            .register(self.manager)
+        self.drain()
+        device = self.server._devices[0]
+        config_id = device.config_id
+        # Another device doesn't change the configuration of the first
+        BinarySwitch(Manifest("second-switch", "Second Switch")) \
+            .register(self.manager)
+        self.drain()
+        self.assertEqual(device.config_id, config_id)
+        self.assertEqual(updated, [])
+        # A changed description is announced with ssdp:update (paced)
+        self.server.update_devices([first])
+        self.drain()
+        self.assertEqual(device.config_id, config_id + 1)
+        self.assertEqual(updated, [device])
+        sender = [c for c in flatten(self.manager)
+                  if isinstance(c, SSDPSender)][0]
+        self.assertTrue((device.uuid, "update") in sender._announcements)
+
+    def test_icons(self):
+        BinarySwitch(Manifest("icon-switch", "Icon Switch",
+                              icons=[Icon(DEFAULT_ICON)])) \
+            .register(self.manager)
+        self.drain()
+        device = self.server._devices[0]
+        base = "http://127.0.0.1:%d" % self.server.web_server.port
+        thread = self.manager.start()[0]
+        try:
+            desc = ElementTree.fromstring(urllib2.urlopen \
+                (base + device.path + "/description.xml").read())
+            icons = desc.findall("{%s}device/{%s}iconList/{%s}icon"
+                                 % ((SSDP_DEVICE_SCHEMA,) * 3))
+            self.assertEqual(len(icons), 1)
+            self.assertEqual(icons[0].findtext("{%s}mimetype" 
+                                               % SSDP_DEVICE_SCHEMA),
+                             "image/png")
+            response = urllib2.urlopen \
+                (base + icons[0].findtext("{%s}url" % SSDP_DEVICE_SCHEMA))
+            self.assertEqual(response.info().get("Content-Type"), "image/png")
+            self.assertEqual(response.read(), open(DEFAULT_ICON, "rb").read())
+            try:
+                urllib2.urlopen(base + device.path + "/icons/missing.png")
+                self.fail("Missing icon found")
+            except urllib2.HTTPError as error:
+                self.assertEqual(error.code, 404)
+        finally:
+            self.manager.stop()
+            # The server closes its store when stopped
+            thread.join()
+
+    def test_not_modified(self):
+        BinarySwitch(Manifest("cached-switch", "Cached Switch")) \
+            .register(self.manager)
+        self.drain()
+        path = self.server._devices[0].path + "/description.xml"
+        thread = self.manager.start()[0]
+        try:
+            connection = httplib.HTTPConnection \
+                ("127.0.0.1", self.server.web_server.port)
+            connection.request("GET", path)
+            response = connection.getresponse()
+            length = len(response.read())
+            etag = response.getheader("ETag")
+            for static in (True, False):
+                if not static:
+                    # Let the controller answer the request
+                    for store in [c for c in flatten(self.manager)
+                                  if isinstance(c, StaticResponses)]:
+                        store.unregister()
+                connection.request("GET", path, headers={ "If-None-Match":
+                                                          etag })
+                response = connection.getresponse()
+                self.assertEqual(response.status, 304)
+                self.assertEqual(response.getheader("ETag"), etag)
+                self.assertEqual(response.getheader("Content-Length"), None)
+                self.assertEqual(response.read(), "")
+                # Connection is still usable
+                connection.request("GET", path)
+                response = connection.getresponse()
+                self.assertEqual(len(response.read()), length)
+            connection.close()
+        finally:
+            self.manager.stop()
+            thread.join()
+
+    def test_subscribe(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        listener.settimeout(5)
+        received = []
+        def receive():
+            connection = listener.accept()[0]
+            data = ""
+            while "\r\n\r\n" not in data:
+                data += connection.recv(4096)
+            head, body = data.split("\r\n\r\n", 1)
+            length = int(head.lower().split("content-length: ")[1]
+                         .split("\r\n")[0])
+            while len(body) < length:
+                body += connection.recv(4096)
+            connection.sendall("HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+            connection.close()
+            received.append((head, body))
+        receiver = threading.Thread(target=receive)
+        receiver.start()
+        BinarySwitch(Manifest("evented-switch", "Evented Switch")) \
+            .register(self.manager)
+        self.drain()
+        controller = [c for c in flatten(self.manager)
+                      if isinstance(c, UPnPServiceController)][0]
+        thread = self.manager.start()[0]
+        try:
+            connection = httplib.HTTPConnection \
+                ("127.0.0.1", self.server.web_server.port)
+            connection.request("SUBSCRIBE", controller.channel.path + "/sub",
+                               headers={ "CALLBACK": "<http://127.0.0.1:%d/cb>"
+                                         % listener.getsockname()[1],
+                                         "NT": "upnp:event",
+                                         "TIMEOUT": "Second-300",
+                                         "Connection": "close" })
+            response = connection.getresponse()
+            self.assertEqual(response.read(), "")
+            self.assertEqual(response.status, 200)
+            sid = response.getheader("SID")
+            self.assertTrue(sid.startswith("uuid:"))
+            self.assertEqual(response.getheader("Timeout"), "Second-300")
+            self.assertEqual(response.getheader("Content-Length"), "0")
+            self.assertEqual(response.getheader("Content-Type"), None)
+            # Set by circuits after the pre-encoded headers
+            self.assertEqual(response.getheader("Connection"), "close")
+            self.assertEqual(len([header for header in response.getheaders()
+                                  if header[0] == "server"]), 1)
+            connection.close()
+            receiver.join(5)
+        finally:
+            self.manager.stop()
+            thread.join()
+            listener.close()
+        head, body = received[0]
+        lines = head.split("\r\n")
+        self.assertTrue(lines[0].startswith("NOTIFY /cb HTTP/1.1"))
+        headers = dict((line.split(": ", 1)[0].upper(), line.split(": ", 1)[1])
+                       for line in lines[1:])
+        self.assertEqual(headers["SID"], sid)
+        self.assertEqual(headers["SEQ"], "0")
+        self.assertEqual(headers["NT"], "upnp:event")
+        self.assertEqual(headers["NTS"], "upnp:propchange")
+        self.assertEqual(int(headers["CONTENT-LENGTH"]), len(body))
+        self.assertTrue("propertyset" in body)
+
+    def add_providers(self, count):
+        path = tempfile.mkdtemp()
+        manager = Manager()
+        server = UPnPDeviceServer(path).register(manager)
+        manager.fire(Event.create("started", manager), "application")
+        while len(manager) > 0:
+            manager.flush()
+        providers = [BinarySwitch(Manifest("switch-%d" % i, "Switch %d" % i))
+                     for i in range(count)]
+        # Count the lookups of handlers that involve the complete tree
+        lookups = []
+        get_handlers = manager.getHandlers
+        def count_lookup(event, channel, **kwargs):
+            lookups.append(event.name)
+            return get_handlers(event, channel, **kwargs)
+        manager.getHandlers = count_lookup
+        server.add_providers(providers)
+        while len(manager) > 0:
+            manager.flush()
+        self.assertEqual(len(server._devices), count)
+        server._uuid_db.close()
+        shutil.rmtree(path, ignore_errors=True)
+        return len(lookups)
+
+    def test_add_providers_scaling(self):
+        # Lookups growing with the number of providers would make
+        # adding them take quadratic time
+        self.assertEqual(self.add_providers(40), self.add_providers(10))
+
+    def test_soak(self):
+        for _ in range(5):
+            self.cycle()
+        gc.collect()
+        components = len(list(flatten(self.manager)))
+        timers = len(TimerSchedule._timers)
+        objects = len(gc.get_objects())
+        for _ in range(50):
+            self.cycle()
+        gc.collect()
+        self.assertEqual(len(list(flatten(self.manager))), components)
+        self.assertEqual(len(TimerSchedule._timers), timers)
+        # Allow for caches that are still being filled
+        self.assertLess(len(gc.get_objects()) - objects, 500)
@@ -0,0 +1,50 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+import os
+import struct
+from unittest import TestCase
+from cocy.providers import Icon
+from cocy.upnp.icons import image_info, icon_variants
+import cocy.portlets
+
+DEFAULT_ICON = os.path.join(os.path.dirname(cocy.portlets.__file__),
+                            "templates", "themes", "default",
+                            "default-device.png")
+
+
+class TestIcons(TestCase):
+
+    def test_image_info(self):
+        self.assertEqual(image_info(open(DEFAULT_ICON, "rb").read()),
+                         ("image/png", 32, 32))
+        self.assertEqual(image_info("GIF89a" + struct.pack("<HH", 16, 8)),
+                         ("image/gif", 16, 8))
+        jpeg = "\xff\xd8" + "\xff\xe0" + struct.pack(">H", 4) + "xx" \
+            + "\xff\xc0" + struct.pack(">HBHH", 17, 8, 120, 160)
+        self.assertEqual(image_info(jpeg), ("image/jpeg", 160, 120))
+        self.assertRaises(ValueError, image_info, "BM")
+
+    def test_variants(self):
+        variants = icon_variants(Icon(DEFAULT_ICON))
+        self.assertEqual(variants[0].name, "32x32.png")
+        self.assertEqual(variants[0].document.body,
+                         open(DEFAULT_ICON, "rb").read())
+        self.assertTrue(icon_variants(Icon(DEFAULT_ICON))[0] is variants[0])
@@ -0,0 +1,59 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from unittest import TestCase
+from cocy.upnp.census import SSDPCensus
+from cocy.upnp.ssdp_message import NOTIFY, M_SEARCH
+
+ALIVE = "NOTIFY * HTTP/1.1\r\n" \
+    "HOST: 239.255.255.250:1900\r\n" \
+    "CACHE-CONTROL: max-age=1800\r\n" \
+    "LOCATION: http://192.168.1.%d:1400/desc.xml\r\n" \
+    "NT: upnp:rootdevice\r\n" \
+    "NTS: ssdp:alive\r\n" \
+    "USN: uuid:%d::upnp:rootdevice\r\n" \
+    "\r\n"
+
+SEARCH = "M-SEARCH * HTTP/1.1\r\nST: ssdp:all\r\nMX: 2\r\n\r\n"
+
+class TestSSDPCensus(TestCase):
+
+    def test_census(self):
+        census = SSDPCensus(window=10, max_devices=4, max_talkers=2)
+        start = census._started
+        for i in range(10):
+            census.record(("192.168.1.1", 1900), ALIVE % (1, 1), start + i)
+        for device in range(2, 8):
+            census.record(("192.168.1.%d" % device, 1900),
+                          ALIVE % (device, device), start + 9)
+        census.record(("192.168.1.1", 1900), SEARCH, start + 9)
+        census.record(("192.168.1.1", 1900), "garbage", start + 9)
+        snapshot = census.snapshot(now=start + 9, top=1)
+        self.assertEqual(snapshot["totals"][NOTIFY], 16)
+        self.assertEqual(snapshot["totals"][M_SEARCH], 1)
+        self.assertEqual(snapshot["invalid"], 1)
+        self.assertAlmostEqual(snapshot["rates"][NOTIFY], 15 / 9.0)
+        # Memory is bounded
+        self.assertEqual(snapshot["devices"], 4)
+        self.assertEqual(snapshot["devices_dropped"], 3)
+        self.assertEqual(snapshot["usns"], 7)
+        self.assertEqual(len(census._talkers), 2)
+        self.assertEqual(snapshot["top_devices"][0]["messages"], 1)
+        self.assertEqual(snapshot["top_devices"][0]["max_age"], 1800)
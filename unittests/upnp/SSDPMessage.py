@@ -0,0 +1,70 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from unittest import TestCase
+from cocy.upnp.ssdp_message import parse_ssdp_message, NOTIFY, M_SEARCH,\
+    RESPONSE
+
+ALIVE = "NOTIFY * HTTP/1.1\r\n" \
+    "HOST: 239.255.255.250:1900\r\n" \
+    "cache-control: max-age = 1800\r\n" \
+    "Location: http://192.168.1.2:1400/desc.xml\r\n" \
+    "NT: upnp:rootdevice\r\n" \
+    "NTS: ssdp:alive\r\n" \
+    "SERVER: Linux UPnP/1.0 Test/1.0\r\n" \
+    "USN: uuid:1234::upnp:rootdevice\r\n" \
+    "BOOTID.UPNP.ORG: 42\r\n" \
+    "\r\n"
+
+class TestSSDPMessage(TestCase):
+
+    def test_notify(self):
+        msg = parse_ssdp_message(ALIVE)
+        self.assertEqual(msg.method, NOTIFY)
+        self.assertEqual(msg.max_age, 1800)
+        self.assertEqual(msg.location, "http://192.168.1.2:1400/desc.xml")
+        self.assertEqual(msg.notification_type, "upnp:rootdevice")
+        self.assertEqual(msg.sub_type, "ssdp:alive")
+        self.assertEqual(msg.usn, "uuid:1234::upnp:rootdevice")
+        self.assertEqual(msg.boot_id, 42)
+        self.assertEqual(msg.config_id, None)
+        self.assertEqual(msg.header("Server"), "Linux UPnP/1.0 Test/1.0")
+        self.assertTrue("cache-control" in msg)
+
+    def test_search(self):
+        msg = parse_ssdp_message("M-SEARCH * HTTP/1.1\nHost:239.255.255.250"
+                                 ":1900\nST:ssdp:all\nMX:3\n\n")
+        self.assertEqual(msg.method, M_SEARCH)
+        self.assertEqual(msg.search_target, "ssdp:all")
+        self.assertEqual(msg.mx, 3)
+
+    def test_response(self):
+        msg = parse_ssdp_message("HTTP/1.1 200 OK\r\nST: uuid:1234\r\n"
+                                 "USN: uuid:1234\r\nEXT:\r\n\r\n")
+        self.assertEqual(msg.method, RESPONSE)
+        self.assertEqual(msg.notification_type, "uuid:1234")
+        self.assertEqual(msg.header("EXT"), "")
+        self.assertEqual(msg.max_age, None)
+
+    def test_invalid(self):
+        self.assertEqual(parse_ssdp_message(""), None)
+        self.assertEqual(parse_ssdp_message("GET / HTTP/1.1\r\n\r\n"), None)
+        self.assertEqual(parse_ssdp_message("HTTP/1.1 404 Not Found\r\n"),
+                         None)
@@ -0,0 +1,174 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from time import time
+from unittest import TestCase
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from circuits.core.manager import Manager
+from circuits.net.sockets import read
+from circuits_bricks.core.timers import TimerSchedule
+from cocy.upnp.device_server import devices_available
+from cocy.upnp.ssdp import SSDPReceiver, SSDPSender, ssdp_listen
+
+ALIVE = "NOTIFY * HTTP/1.1\r\n" \
+    "Host: 239.255.255.250:1900\r\n" \
+    "Cache-Control: max-age=1800\r\n" \
+    "Location: http://192.168.1.2:1400/desc.xml\r\n" \
+    "NT: %s\r\n" \
+    "NTS: ssdp:alive\r\n" \
+    "Server: Linux UPnP/1.0 Test/1.0\r\n" \
+    "USN: uuid:1234::%s\r\n" \
+    "BOOTID.UPNP.ORG: %d\r\n" \
+    "\r\n"
+
+BYEBYE = "NOTIFY * HTTP/1.1\r\n" \
+    "Host: 239.255.255.250:1900\r\n" \
+    "NT: upnp:rootdevice\r\n" \
+    "NTS: ssdp:byebye\r\n" \
+    "USN: uuid:1234::upnp:rootdevice\r\n" \
+    "BOOTID.UPNP.ORG: 1\r\n" \
+    "\r\n"
+
+class TestSSDPReceiver(TestCase):
+
+    def setUp(self):
+        self.receiver = SSDPReceiver()
+        self.fired = []
+        self.receiver.fire = lambda event, *channels: \
+            self.fired.append(event.name)
+
+    def read(self, data):
+        self.receiver._on_read(None, ("192.168.1.2", 1900), data)
+
+    def test_listened(self):
+        self.read(ALIVE % ("upnp:rootdevice", "upnp:rootdevice", 1))
+        self.assertEqual(self.fired, [])
+        self.receiver._on_listen(["upnp:rootdevice"])
+        self.read(ALIVE % ("upnp:rootdevice", "upnp:rootdevice", 1))
+        self.read(ALIVE % ("urn:x:device:y:1", "urn:x:device:y:1", 1))
+        self.assertEqual(self.fired, ["upnp_device_alive"])
+        self.assertEqual(self.receiver.counters["unlistened_dropped"], 2)
+        # Registrations are counted
+        self.receiver._on_listen(["upnp:rootdevice"])
+        self.receiver._on_unlisten(["upnp:rootdevice"])
+        self.assertEqual(self.receiver._listened, { "upnp:rootdevice": 1 })
+        self.receiver._on_unlisten(["upnp:rootdevice"])
+        self.assertEqual(self.receiver._listened, {})
+
+    def test_own(self):
+        self.receiver._on_listen(["ssdp:all"])
+        self.receiver._on_own_device("1234", 7)
+        self.read(ALIVE % ("upnp:rootdevice", "upnp:rootdevice", 7))
+        self.assertEqual(self.fired, [])
+        self.assertEqual(self.receiver.counters["own_dropped"], 1)
+        # Same uuid with another boot id isn't ours
+        self.read(ALIVE % ("upnp:rootdevice", "upnp:rootdevice", 8))
+        self.assertEqual(self.fired, ["upnp_device_alive"])
+
+    def test_byebye(self):
+        self.receiver._on_listen(["ssdp:all"])
+        alive = ALIVE % ("upnp:rootdevice", "upnp:rootdevice", 1)
+        self.read(alive)
+        self.read(alive)
+        self.read(BYEBYE)
+        self.read(BYEBYE)
+        # The device may come back at once
+        self.read(alive)
+        self.assertEqual(self.fired, ["upnp_device_alive", 
+                                      "upnp_device_bye_bye",
+                                      "upnp_device_alive"])
+        # Expired messages are removed from the index as well
+        self.receiver._recent.add("other", now=time() + 10)
+        self.assertEqual(self.receiver._recent.indexed
+                         ("uuid:1234::upnp:rootdevice"), [])
+
+
+class Service(object):
+
+    type_ver = "SwitchPower:1"
+
+
+class Device(object):
+
+    uuid = "1234"
+    root_device = True
+    type_ver = "BinaryLight:1"
+    services = [Service()]
+    config_id = 1
+    web_server_port = 8080
+
+
+class Listener(BaseComponent):
+
+    def __init__(self):
+        super(Listener, self).__init__()
+        self.received = []
+
+    @handler("upnp_device_alive", "upnp_device_bye_bye", channel="*")
+    def _on_device(self, event, *args):
+        self.received.append(event.name)
+
+
+class TestOwnTraffic(TestCase):
+
+    def setUp(self):
+        self.manager = Manager()
+        self.sender = SSDPSender().register(self.manager)
+        self.sender.interfaces = { "test": "192.168.1.2" }
+        self.receiver = SSDPReceiver().register(self.manager)
+        self.listener = Listener().register(self.manager)
+        self.manager.fire(ssdp_listen(["ssdp:all"]), "ssdp")
+        self.manager.fire(devices_available([Device()]), "upnp")
+        self.drain()
+
+    def tearDown(self):
+        for timer in list(TimerSchedule._timers):
+            if timer.root is self.manager:
+                timer.unregister()
+
+    def drain(self):
+        while len(self.manager) > 0:
+            self.manager.flush()
+
+    def read(self, data):
+        self.manager.fire(read(("192.168.1.2", 1900), data), "ssdp")
+        self.drain()
+
+    def test_dropped(self):
+        datagrams = self.sender._device_datagrams(Device(), "test")
+        notifications = [datagram.render("DATE")
+                         for datagram in datagrams.messages["available"]
+                         + datagrams.messages["unavailable"]]
+        for notification in notifications:
+            self.read(notification)
+            # Header names are case-insensitive, whitespace is optional
+            self.read(notification.replace("USN: ", "usn:")
+                      .replace("BOOTID.UPNP.ORG: ", "BootId.UPnP.org:  "))
+        self.assertEqual(self.listener.received, [])
+        self.assertEqual(self.receiver.counters["own_dropped"],
+                         2 * len(notifications))
+        # Search results from our devices are passed on
+        self.read(datagrams.messages["result"][0].render("DATE"))
+        self.assertEqual(self.listener.received, ["upnp_device_alive"])
+        # Another device with the same uuid
+        self.read(ALIVE % ("upnp:rootdevice", "upnp:rootdevice",
+                           self.sender._boot_id + 1))
+        self.assertEqual(self.listener.received, ["upnp_device_alive"] * 2)
@@ -0,0 +1,69 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+import time
+from unittest import TestCase
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from circuits.core.manager import Manager
+from circuits_bricks.core.timers import TimerSchedule
+from cocy.upnp.ssdp import SSDPResponseScheduler, SSDPDatagram
+
+
+class Collector(BaseComponent):
+
+    channel = "ssdp"
+
+    def __init__(self):
+        super(Collector, self).__init__()
+        self.sent = dict()
+
+    @handler("ssdp_write_batch")
+    def _on_write_batch(self, datagrams, interface=None):
+        self.sent[interface] = self.sent.get(interface, 0) + len(datagrams)
+
+
+class TestSSDPResponseScheduler(TestCase):
+
+    def test_interfaces(self):
+        manager = Manager()
+        collector = Collector().register(manager)
+        interfaces = ["192.168.1.1", "10.0.0.1"]
+        for interface in interfaces:
+            scheduler = SSDPResponseScheduler(interface, "ssdp", 100) \
+                .register(manager)
+            datagrams = [SSDPDatagram("urn:x:device:y:%d" % i, "NT: %d" % i)
+                         for i in range(60)]
+            scheduler.schedule(("192.168.1.2", 1900), datagrams, 1)
+        timers = len(TimerSchedule._timers)
+        max_timers = timers
+        manager.start()
+        try:
+            deadline = time.time() + 4
+            while time.time() < deadline \
+                and sum(collector.sent.values()) < 120:
+                time.sleep(0.01)
+                max_timers = max(max_timers, len(TimerSchedule._timers))
+        finally:
+            manager.stop()
+        self.assertEqual(collector.sent, dict([(itf, 60) 
+                                               for itf in interfaces]))
+        # At most one timer per scheduler
+        self.assertLessEqual(max_timers - timers, len(interfaces))
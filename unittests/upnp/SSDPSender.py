@@ -0,0 +1,133 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from unittest import TestCase
+from cocy.upnp import SERVER_HELLO
+from cocy.upnp.ssdp import SSDPSender, notification_types
+
+SERVICE = "urn:schemas-upnp-org:service:AVTransport"
+DEVICE = "urn:schemas-upnp-org:device:MediaRenderer"
+DATE = "Thu, 01 Jan 2026 00:00:00 GMT"
+OTHER_DATE = "Fri, 02 Jan 2026 00:00:00 GMT"
+
+
+class Service(object):
+
+    type_ver = "AVTransport:2"
+
+
+class Device(object):
+
+    uuid = "1234"
+    root_device = True
+    type_ver = "MediaRenderer:2"
+    services = [Service()]
+    config_id = 1
+    web_server_port = 8080
+
+
+class TestSSDPSender(TestCase):
+
+    def setUp(self):
+        self.sender = SSDPSender()
+        self.sender.interfaces = { "test": "192.168.1.2" }
+        self.device = Device()
+
+    def datagrams(self):
+        return self.sender._device_datagrams(self.device, "test")
+
+    def uncached(self, template_name, nt, usn):
+        # As the messages were rendered before they were cached
+        config_id, location, max_age, boot_id \
+            = self.sender._datagrams_key(self.device, "test")
+        message = self.sender._get_template(template_name) \
+            % { "BOOTID": boot_id, "SERVER": SERVER_HELLO,
+                "CACHE-CONTROL": max_age, "CONFIGID": config_id,
+                "DATE": DATE, "LOCATION": location, "NT": nt, "USN": usn }
+        return "".join([line + "\r\n" for line in message.splitlines()]) \
+            + "\r\n"
+
+    def test_rendered(self):
+        datagrams = self.datagrams()
+        types = notification_types(self.device)
+        for msg_type, template_name in self.sender._msg_templates.items():
+            messages = datagrams.messages[msg_type]
+            self.assertEqual(len(messages), len(types))
+            for datagram, (nt, usn) in zip(messages, types):
+                self.assertEqual(datagram.render(DATE),
+                                 self.uncached(template_name, nt, usn))
+
+    def test_date_only(self):
+        datagrams = self.datagrams()
+        # Templates aren't rendered again
+        self.sender._get_template = None
+        self.assertTrue(self.datagrams() is datagrams)
+        for messages in datagrams.messages.values():
+            for datagram in messages:
+                message = datagram.render(DATE)
+                other = datagram.render(OTHER_DATE)
+                if "\r\nDate: " in message:
+                    self.assertEqual(message.replace(DATE, OTHER_DATE), other)
+                else:
+                    self.assertTrue(message is other)
+
+    def test_invalidated(self):
+        changes = [("CONFIGID.UPNP.ORG: 2",
+                    lambda: setattr(self.device, "config_id", 2)),
+                   ("Location: http://192.168.1.3:8080/",
+                    lambda: setattr(self.sender, "interfaces",
+                                    { "test": "192.168.1.3" })),
+                   ("Location: http://192.168.1.3:8081/",
+                    lambda: setattr(self.device, "web_server_port", 8081)),
+                   ("Cache-Control: max-age=900",
+                    lambda: self.sender._on_config_value
+                    ("upnp", "max-age", "900")),
+                   ("BOOTID.UPNP.ORG: 5",
+                    lambda: self.sender._boot_ids.__setitem__("1234", 5))]
+        for header, change in changes:
+            datagrams = self.datagrams()
+            change()
+            self.assertFalse(self.datagrams() is datagrams)
+            for messages in self.datagrams().messages.values():
+                for datagram in messages:
+                    message = datagram.render(DATE)
+                    if header.split(":")[0] + ":" in message:
+                        self.assertTrue(header in message)
+            # Search results are rendered from the new messages
+            self.assertTrue(header in self.datagrams()
+                            .results(DEVICE + ":1")[0].render(DATE))
+
+    def test_search_versions(self):
+        datagrams = self.datagrams()
+        results = datagrams.results(SERVICE + ":2")
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results[0] in datagrams.messages["result"])
+        # Lower versions are found, the search target is echoed back
+        results = datagrams.results(SERVICE + ":1")
+        self.assertEqual(len(results), 1)
+        message = results[0].render("DATE")
+        self.assertTrue("\r\nST: %s:1\r\n" % SERVICE in message)
+        self.assertTrue("\r\nUSN: uuid:1234::%s:2\r\n" % SERVICE in message)
+        self.assertTrue(datagrams.results(SERVICE + ":1") is results)
+        self.assertEqual(len(datagrams.results(DEVICE + ":1")), 1)
+        # Higher versions and other types are not
+        self.assertEqual(datagrams.results(SERVICE + ":3"), ())
+        self.assertEqual(datagrams.results(SERVICE + "Other:1"), ())
+        self.assertEqual(len(datagrams.results("uuid:1234")), 1)
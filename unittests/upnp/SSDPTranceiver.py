@@ -0,0 +1,58 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+import socket
+from unittest import TestCase
+from circuits.core.manager import Manager
+from circuits.net.sockets import write
+from cocy.upnp.ssdp import SSDPTranceiver, ssdp_write_batch
+
+
+class TestSSDPTranceiver(TestCase):
+
+    def setUp(self):
+        self.manager = Manager()
+        self.tranceiver = SSDPTranceiver().register(self.manager)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(5)
+        self.address = self.socket.getsockname()
+
+    def tearDown(self):
+        self.socket.close()
+
+    def test_batch(self):
+        self.manager.fire(write(self.address, "0"), "ssdp")
+        batch = [(self.address, str(i)) for i in range(1, 4)]
+        self.manager.fire(ssdp_write_batch(batch), "ssdp")
+        self.manager.fire(write(self.address, "4"), "ssdp")
+        thread = self.manager.start()[0]
+        try:
+            received = [self.socket.recv(64) for _ in range(5)]
+        finally:
+            self.manager.stop()
+            thread.join()
+        # Batched datagrams are sent in order with the others
+        self.assertEqual(received, ["0", "1", "2", "3", "4"])
+        self.assertEqual(self.tranceiver.dispatches_saved, 2)
+
+    def test_unknown_interface(self):
+        self.tranceiver._on_write_batch([(self.address, "0")], "10.0.0.1")
+        self.assertEqual(self.tranceiver.dispatches_saved, 0)
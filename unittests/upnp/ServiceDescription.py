@@ -0,0 +1,66 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from xml.etree import ElementTree
+import cocy.upnp.service
+from cocy.upnp.service import service_description, UPnPService
+
+
+class TestServiceDescription(TestCase):
+
+    def test_tables(self):
+        desc = service_description("SwitchPower", 1, 3)
+        self.assertEqual(desc.actions["SetTarget"],
+                         [("newTargetValue", "in", "Target")])
+        self.assertEqual(desc.state_variables["Status"],
+                         ("boolean", "yes", "0"))
+        self.assertTrue('configId="3"' in desc.text)
+        self.assertFalse("\t" in desc.text)
+        self.assertEqual(desc.document.content_type, 'text/xml; charset="utf-8"')
+
+    def test_shared(self):
+        desc = service_description("SwitchPower", "1", 1)
+        self.assertTrue(service_description("SwitchPower", 1, 1) is desc)
+        other = service_description("SwitchPower", 1, 2)
+        self.assertFalse(other is desc)
+        self.assertTrue('configId="1"' in desc.text)
+        self.assertTrue('configId="2"' in other.text)
+
+    def test_missing(self):
+        self.assertRaises(IOError, service_description, "NoSuchService", 1, 1)
+        self.assertRaises(IOError, UPnPService, 1, "NoSuchService:1")
+
+    def test_invalid(self):
+        service_dir = tempfile.mkdtemp()
+        saved = cocy.upnp.service._service_dir
+        try:
+            with open(os.path.join(service_dir, "Broken_1.xml"), "w") as f:
+                f.write("<scpd>")
+            cocy.upnp.service._service_dir = service_dir
+            # Detected when the service is created, not when requested
+            self.assertRaises(ElementTree.ParseError, 
+                              UPnPService, 1, "Broken:1")
+        finally:
+            cocy.upnp.service._service_dir = saved
+            shutil.rmtree(service_dir, ignore_errors=True)
@@ -0,0 +1,90 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from io import BytesIO
+from unittest import TestCase
+import cocy.misc
+from cocy.misc import parseSoapAction
+
+SERVICE_NS = "urn:schemas-upnp-org:service:SwitchPower:1"
+
+ENVELOPE = '<?xml version="1.0" encoding="utf-8"?>' \
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"' \
+    ' s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">' \
+    '%s<s:Body>%s</s:Body></s:Envelope>'
+
+
+class Request(object):
+
+    def __init__(self, body, content_type='text/xml; charset="utf-8"'):
+        self.headers = { "SOAPAction": '"%s#SetTarget"' % SERVICE_NS,
+                         "Content-Type": content_type }
+        self.body = BytesIO(body)
+
+
+class TestSoapAction(TestCase):
+
+    def setUp(self):
+        self.fallbacks = 0
+        self._parseSoapRequest = cocy.misc.parseSoapRequest
+        def counting(request):
+            self.fallbacks += 1
+            return self._parseSoapRequest(request)
+        cocy.misc.parseSoapRequest = counting
+
+    def tearDown(self):
+        cocy.misc.parseSoapRequest = self._parseSoapRequest
+
+    def parse(self, body, header="", **kwargs):
+        return parseSoapAction(Request(ENVELOPE % (header, body), **kwargs))
+
+    def test_simple(self):
+        result = self.parse('<u:SetTarget xmlns:u="%s">'
+                            '<newTargetValue>1</newTargetValue>'
+                            '<Empty></Empty></u:SetTarget>' % SERVICE_NS)
+        self.assertEqual(result, (SERVICE_NS, "SetTarget",
+                                  { "newTargetValue": "1", "Empty": None }))
+        self.assertEqual(self.fallbacks, 0)
+
+    def test_header_ignored(self):
+        result = self.parse('<u:GetStatus xmlns:u="%s"/>' % SERVICE_NS,
+                            header='<s:Header><x:Info xmlns:x="urn:x">'
+                            '<x:Value>1</x:Value></x:Info></s:Header>')
+        self.assertEqual(result, (SERVICE_NS, "GetStatus", {}))
+        self.assertEqual(self.fallbacks, 0)
+
+    def test_entities(self):
+        result = self.parse('<u:SetName xmlns:u="%s">'
+                            '<Name>a &amp; b &#228;</Name></u:SetName>'
+                            % SERVICE_NS)
+        self.assertEqual(result[2], { "Name": u"a & b \xe4" })
+
+    def test_fallback(self):
+        # Multi-reference values are resolved by soaplib
+        result = self.parse('<u:SetTarget xmlns:u="%s">'
+                            '<newTargetValue href="#v"/></u:SetTarget>'
+                            '<value id="v">1</value>' % SERVICE_NS)
+        self.assertEqual(self.fallbacks, 1)
+        self.assertEqual(result[:2], (SERVICE_NS, "SetTarget"))
+        # Other charsets are decoded by soaplib
+        result = self.parse('<u:GetStatus xmlns:u="%s"/>' % SERVICE_NS,
+                            content_type="text/xml; charset=iso-8859-1")
+        self.assertEqual(self.fallbacks, 2)
+        self.assertEqual(result, (SERVICE_NS, "GetStatus", {}))